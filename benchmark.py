@@ -0,0 +1,528 @@
+"""
+Benchmark harness for the Fake Soccer Bot's game message and game management hot paths
+
+Plays complete games through the real Listener and GameManagement cogs against fake nextcord guilds, channels, users
+and messages, and an in-process stand-in for the PostgreSQL pool, then reports latency percentiles and throughput for
+each path. Runs are seeded, so results can be compared between commits. Run `python benchmark.py --help` for options.
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import logging
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+import warnings
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import nextcord
+
+import outbox
+import queries
+import sqlite_db
+from cogs import GameManagement
+from discord_db_client import Bot
+from game_cache import FINISHED_STATES, GameState
+from listener import Listener
+from queries import GAME_COLUMNS
+from ranges import RANGES, Results
+from standings import COUNTED_STATES
+
+logger = logging.getLogger('fakeSoccerBot')
+
+ids = itertools.count(10 ** 17)
+
+
+# In-process database
+
+def now() -> datetime:
+    """LOCALTIMESTAMP, naive like the deadline column."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class MemoryStatement:
+    """Stands in for an asyncpg PreparedStatement, answering a query from a Python function."""
+    __slots__ = ('database', 'run')
+
+    def __init__(self, database: 'MemoryDatabase', run: Callable[..., List[Dict[str, Any]]]):
+        self.database = database
+        self.run = run
+
+    async def fetch(self, *args) -> List[Dict[str, Any]]:
+        if self.database.latency:
+            await asyncio.sleep(self.database.latency)
+        return self.run(*args)
+
+    async def fetchrow(self, *args) -> Optional[Dict[str, Any]]:
+        rows = await self.fetch(*args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, *args):
+        row = await self.fetchrow(*args)
+        return None if row is None else next(iter(row.values()))
+
+
+class MemoryDatabase:
+    """In-process stand-in for the Bot.db pool, holding the games, teams and writeups tables in dicts.
+
+    It only understands the queries in the registry that the benchmarked paths run, looked up by name, and acts as
+    both the pool and its connections. latency is added to every query, in seconds. Pass --sqlite to benchmark
+    against the embedded SQLite backend instead."""
+    UPDATE_GAME = re.compile(r'UPDATE games SET (.*) WHERE (.*) RETURNING')
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.games: Dict[int, Dict[str, Any]] = {}
+        self.teams: Dict[str, Dict[str, Any]] = {}
+        self.writeups: Dict[int, Dict[str, Any]] = {}
+        self.plays: List[tuple] = []
+        self.statements = self
+        self._gameids = itertools.count(1)
+        self._handlers = {
+            'active_games': lambda: [dict(game) for game in self.games.values() if game['gamestate'] not in FINISHED_STATES],
+            'finished_games': lambda: [dict(game) for game in self.games.values()
+                                       if game['gamestate'] in COUNTED_STATES and not game['isscrimmage']],
+            'game_by_id': lambda gameid: [dict(self.games[gameid])] if gameid in self.games else [],
+            'game_by_channel': lambda channelid: [dict(game) for game in reversed(self.games.values()) if game['channelid'] == channelid][:1],
+            'database_time': lambda: [{'database_time': now()}],
+            'create_game': self.create_game,
+            'create_team': self.create_team,
+            'create_writeup': self.create_writeup,
+            'forfeit_games': lambda *columns: self.expire(columns, forfeit=True),
+            'delay_games': lambda *columns: self.expire(columns, forfeit=False),
+            'all_teams': lambda: [dict(team) for team in self.teams.values()],
+            'team': lambda teamid: [dict(self.teams[teamid])] if teamid in self.teams else [],
+            'team_names': lambda *teamids: [{'teamid': teamid, 'teamname': self.teams[teamid]['teamname']}
+                                            for teamid in dict.fromkeys(teamids) if teamid in self.teams],
+            'acting_manager': lambda teamid: [{'manager': self.teams[teamid]['substitute'] or self.teams[teamid]['manager']}]
+                                             if teamid in self.teams else [],
+            'enabled_writeups': lambda: [dict(writeup) for writeup in self.writeups.values() if not writeup['disabled']],
+            'all_writeups': lambda: [dict(writeup) for writeup in self.writeups.values()],
+        }
+
+    def get(self, name: str) -> MemoryStatement:
+        handler = self._handlers.get(name)
+        if handler is None:
+            if not name.startswith('update_game('):
+                raise NotImplementedError(f'The benchmark database does not support the {name} query')
+            handler = self._handlers[name] = self.update_game(queries.registry.queries[name])
+        return MemoryStatement(self, handler)
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def copy_records_to_table(self, table: str, *, records, columns):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.plays.extend(records)
+
+    def create_team(self, teamid: str, teamname: str, manager: int, color: str):
+        self.teams[teamid] = {'teamname': teamname, 'teamid': teamid, 'substitute': None, 'manager': manager}
+        return []
+
+    def create_writeup(self, gamestate: str, result: str, text: str):
+        writeupid = len(self.writeups) + 1
+        self.writeups[writeupid] = {'writeupid': writeupid, 'gamestate': gamestate, 'result': result,
+                                    'writeuptext': text, 'disabled': False}
+        return [dict(self.writeups[writeupid])]
+
+    def create_game(self, hometeam, awayteam, channelid, homeroleid, awayroleid, isscrimmage, overtimegame):
+        game = dict.fromkeys(GAME_COLUMNS)
+        game.update(gameid=next(self._gameids), hometeam=hometeam, awayteam=awayteam, channelid=channelid,
+                    homeroleid=homeroleid, awayroleid=awayroleid, homescore=0, awayscore=0, seconds=0,
+                    secondhalf=False, gamestate='COIN_TOSS', def_off='OFFENSE', waitingon='AWAY', default_chew=False,
+                    isscrimmage=isscrimmage, overtimegame=overtimegame, homedelays=0, awaydelays=0,
+                    deadline=now() + timedelta(days=1))
+        self.games[game['gameid']] = game
+        return [dict(game)]
+
+    def update_game(self, sql: str) -> Callable[..., List[Dict[str, Any]]]:
+        """Builds a handler for one of the UPDATE statements GameCache.update() registers."""
+        assignments, conditions = self.UPDATE_GAME.match(sql).groups()
+        columns = re.findall(r'(\w+) = \$(\d+)', assignments)
+        reset_deadline = 'deadline =' in assignments
+        gameid_param = int(re.search(r'gameid = \$(\d+)', conditions).group(1))
+        expect = re.findall(r'(\w+) IS NOT DISTINCT FROM \$(\d+)', conditions)
+
+        def run(*args):
+            game = self.games.get(args[gameid_param - 1])
+            if game is None or any(game[column] != args[int(param) - 1] for column, param in expect):
+                return []
+            for column, param in columns:
+                game[column] = args[int(param) - 1]
+            if reset_deadline:
+                game['deadline'] = now() + timedelta(days=1)
+            return [dict(game)]
+        return run
+
+    def expire(self, columns, forfeit: bool) -> List[Dict[str, Any]]:
+        """forfeit_games and delay_games, one expiry per element of the parameter arrays."""
+        updated = []
+        for gameid, homescore, awayscore, homedelays, awaydelays, gamestate, waitingon, def_off, homescore_was, awayscore_was \
+                in zip(*columns):
+            game = self.games.get(gameid)
+            if game is None or (game['gamestate'], game['waitingon'], game['def_off'], game['homescore'], game['awayscore']) \
+                    != (gamestate, waitingon, def_off, homescore_was, awayscore_was) or game['deadline'] > now():
+                continue
+            game.update(homescore=homescore, awayscore=awayscore, homedelays=homedelays, awaydelays=awaydelays)
+            if forfeit:
+                game['gamestate'] = 'FORFEIT'
+            else:
+                game.update(gamestate='MIDFIELD', def_off='DEFENSE', deadline=now() + timedelta(days=1),
+                            waitingon={'HOME': 'AWAY', 'AWAY': 'HOME'}.get(game['waitingon'], game['waitingon']))
+            updated.append(dict(game))
+        return updated
+
+
+# Fake Discord objects
+
+class FakeRole:
+    def __init__(self, name: str):
+        self.id = next(ids)
+        self.name = name
+        self.mention = f'<@&{self.id}>'
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: 'FakeUser', channel, guild: Optional['FakeGuild']):
+        self.id = next(ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+
+    async def pin(self):
+        pass
+
+
+class FakeChannel:
+    """A guild text channel, or a DM channel if guild is None. Sends only count the message and wait send_latency."""
+    def __init__(self, bench: 'Benchmark', name: str, guild: Optional['FakeGuild'] = None):
+        self.id = next(ids)
+        self.name = name
+        self.guild = guild
+        self.mention = f'<#{self.id}>'
+        self.bench = bench
+        bench.channels[self.id] = self
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        self.bench.sent += 1
+        if self.bench.send_latency:
+            await asyncio.sleep(self.bench.send_latency)
+        return FakeMessage(content, self.bench.bot_user, self, self.guild)
+
+
+class FakeUser:
+    def __init__(self, bench: 'Benchmark', name: str):
+        self.id = next(ids)
+        self.name = name
+        self.mention = f'<@{self.id}>'
+        self.dm_channel = FakeChannel(bench, f'dm-{name}')
+        bench.users[self.id] = self
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        return await self.dm_channel.send(content, **kwargs)
+
+
+class FakeGuild:
+    def __init__(self, bench: 'Benchmark'):
+        self.id = next(ids)
+        self.bench = bench
+        self.roles: List[FakeRole] = []
+        self.channels: List[FakeChannel] = []
+        self.categories: List[FakeChannel] = []
+        self._roles: Dict[int, FakeRole] = {}
+
+    def add_role(self, name: str) -> FakeRole:
+        role = FakeRole(name)
+        self.roles.append(role)
+        self._roles[role.id] = role
+        return role
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self._roles.get(role_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.bench.channels.get(channel_id)
+
+    def get_member(self, user_id: int) -> Optional[FakeUser]:
+        return self.bench.users.get(user_id)
+
+    async def create_text_channel(self, name: str, category=None) -> FakeChannel:
+        channel = FakeChannel(self.bench, name, self)
+        self.channels.append(channel)
+        return channel
+
+
+class FakeContext:
+    """Command context of a bot operator using a command in the guild."""
+    def __init__(self, guild: FakeGuild, channel: FakeChannel, author: FakeUser):
+        self.guild = guild
+        self.channel = channel
+        self.author = author
+
+    async def reply(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        return await self.channel.send(content, **kwargs)
+
+
+class BenchBot(Bot):
+    """Bot whose user, channel and guild lookups are answered by the benchmark's fake objects."""
+    def __init__(self, bench: 'Benchmark', **kwargs):
+        self.bench = bench
+        self.errors = 0
+        super().__init__(**kwargs)
+
+    @property
+    def user(self):
+        return self.bench.bot_user
+
+    def get_user(self, user_id: int):
+        return self.bench.users.get(user_id)
+
+    def get_channel(self, channel_id: int):
+        return self.bench.channels.get(channel_id)
+
+    def get_guild(self, guild_id: int):
+        return self.bench.guild
+
+    async def on_error(self, event_method: str, *args, **kwargs):
+        self.errors += 1
+        logger.exception(f'Error in {event_method}')
+
+
+# Benchmark
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Benchmark:
+    """Plays games through the Listener and GameManagement cogs and times every step."""
+    def __init__(self, games: int, concurrency: int, deadline_games: int, seed: int,
+                 query_latency: float = 0.0, send_latency: float = 0.0, sqlite: Optional[str] = None):
+        self.games = games
+        self.concurrency = concurrency
+        self.deadline_games = deadline_games
+        self.rng = random.Random(seed)
+        self.send_latency = send_latency
+        self.sent = 0
+        self.timed_out = 0
+        self.latencies: Dict[str, List[float]] = {}
+        self.channels: Dict[int, FakeChannel] = {}
+        self.users: Dict[int, FakeUser] = {}
+        self.pending: Dict[FakeMessage, asyncio.Future] = {}
+        self.query_latency = query_latency
+        self.sqlite = sqlite
+        self.db = None
+        self.bot_user = FakeUser(self, 'fakeSoccerBot')
+        self.operator = FakeUser(self, 'operator')
+        self.guild = FakeGuild(self)
+        self.managers: Dict[str, FakeUser] = {}
+        self.elapsed = 0.0
+        self.queries = 0
+        self.listener: Optional[Listener] = None
+        self.management: Optional[GameManagement] = None
+        self.bot: Optional[BenchBot] = None
+
+    def record(self, path: str, started: float):
+        self.latencies.setdefault(path, []).append(time.perf_counter() - started)
+
+    async def setup(self):
+        if self.sqlite is None:
+            self.db = MemoryDatabase(self.query_latency)
+        else:
+            self.db = await sqlite_db.create_pool(self.sqlite, init=queries.registry.prepare)
+        for name in ('scores', 'logs', 'commands'):
+            self.guild.channels.append(FakeChannel(self, name, self.guild))
+        for number in range(2 * (self.games + self.deadline_games)):
+            teamid = f't{number:04d}'
+            manager = self.managers[teamid] = FakeUser(self, f'manager-{teamid}')
+            self.guild.add_role(f'Team {teamid}')
+            await queries.execute(self.db, 'create_team', teamid, f'Team {teamid}', manager.id, 'ffffff')
+        for gamestate in RANGES:
+            for result in Results:
+                await queries.execute(self.db, 'create_writeup', gamestate, result.name, '{offteam} against {defteam}: ' + result.name.lower())
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.bot = BenchBot(self, command_prefix='!', intents=nextcord.Intents.default(), db=self.db)
+        self.listener = Listener(self.bot)
+        # The benchmark loads the caches itself, and has no change feed to connect
+        self.listener.refresh_game_team_cache.cancel()
+        self.management = GameManagement(self.bot)
+        self.bot.add_cog(self.listener)
+        self.bot.add_cog(self.management)
+        await self.listener.games.reload()
+        await self.listener.teams.reload()
+        await self.listener.writeups.reload()
+
+        handle = self.listener.mailboxes.handle
+
+        async def timed_handle(message, *args):
+            try:
+                await handle(message, *args)
+            finally:
+                future = self.pending.pop(message, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+        self.listener.mailboxes.handle = timed_handle
+
+    async def start_game(self, hometeam: str, awayteam: str) -> GameState:
+        ctx = FakeContext(self.guild, self.guild.channels[2], self.operator)
+        started = time.perf_counter()
+        await self.management.start_game.callback(self.management, ctx, hometeam, awayteam)
+        self.record('start_game', started)
+        channel = next(channel for channel in reversed(self.guild.channels) if channel.name == f'{hometeam}-{awayteam}')
+        return self.listener.games.get(channel.id)
+
+    async def deliver(self, path: str, content: str, author: FakeUser, channel: FakeChannel):
+        """Sends a message to the bot and waits until its handler has finished with it."""
+        message = FakeMessage(content, author, channel, channel.guild)
+        future = self.pending[message] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        await self.listener.process_game(message)
+        try:
+            await asyncio.wait_for(future, 5)
+        except asyncio.TimeoutError:
+            self.pending.pop(message, None)
+            self.timed_out += 1
+            return
+        self.record(path, started)
+
+    async def play_game(self, hometeam: str, awayteam: str):
+        game = await self.start_game(hometeam, awayteam)
+        channel = self.channels[game.channelid]
+        while game.gamestate not in FINISHED_STATES:
+            manager = self.managers[game.team(game.waitingon)]
+            if game.def_off == 'DEFENSE':
+                await self.deliver('defense', str(self.rng.randint(1, 1000)), manager, manager.dm_channel)
+            elif game.gamestate == 'COIN_TOSS':
+                await self.deliver('coin toss', self.rng.choice(('heads', 'tails')), manager, channel)
+            elif game.gamestate == 'COIN_TOSS_CHOICE':
+                await self.deliver('kickoff choice', self.rng.choice(('kick', 'defer')), manager, channel)
+            else:
+                clock = self.rng.choice(('', '', ' chew', ' hurry'))
+                await self.deliver('offense', f'{self.rng.randint(1, 1000)}{clock}', manager, channel)
+            if self.timed_out:
+                raise RuntimeError(f'A message for game {game.gameid} was never handled, see the log for errors')
+
+    async def expire_deadlines(self):
+        """Starts games and lets every deadline expire twice, first delaying the games and then forfeiting them."""
+        first_team = 2 * self.games
+        games = [await self.start_game(f't{first_team + 2 * number:04d}', f't{first_team + 2 * number + 1:04d}')
+                 for number in range(self.deadline_games)]
+        for path in ('delay_games', 'forfeit_games'):
+            for game in games:
+                if self.sqlite is None:
+                    self.db.games[game.gameid]['deadline'] = now() - timedelta(seconds=1)
+                else:
+                    await self.db.execute('UPDATE games SET deadline = $1 WHERE gameid = $2', now() - timedelta(seconds=1), game.gameid)
+            started = time.perf_counter()
+            await self.listener.expire_deadlines(games)
+            self.record(path, started)
+            games = [game for game in games if game.gamestate not in FINISHED_STATES]
+
+    async def run(self):
+        await self.setup()
+        # Discord's rate limits are not what is being measured
+        outbox.ROUTE_SECONDS = 0.0
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def play(number: int):
+            async with semaphore:
+                await self.play_game(f't{2 * number:04d}', f't{2 * number + 1:04d}')
+
+        queries_before = sum(self.bot.queries.hits.values())
+        started = time.perf_counter()
+        await asyncio.gather(*(play(number) for number in range(self.games)))
+        self.elapsed = time.perf_counter() - started
+        self.queries = sum(self.bot.queries.hits.values()) - queries_before
+        if self.deadline_games:
+            await self.expire_deadlines()
+        await self.listener.play_log.stop()
+        self.listener.cog_unload()
+        if self.sqlite is not None:
+            await self.db.close()
+
+    def report(self) -> str:
+        plays = len(self.latencies.get('offense', ()))
+        messages = sum(len(self.latencies.get(path, ())) for path in ('coin toss', 'kickoff choice', 'offense', 'defense'))
+        lines = [f'{self.games} games, {plays} plays, {messages} messages in {self.elapsed:.2f}s '
+                 f'({self.games / self.elapsed:,.1f} games/s, {plays / self.elapsed:,.0f} plays/s, {messages / self.elapsed:,.0f} messages/s)',
+                 f'{self.sent} Discord messages sent, {self.bot.errors} errors, {self.queries} queries run while playing',
+                 '',
+                 f'{"path":>16}{"count":>9}{"mean":>10}{"p50":>10}{"p90":>10}{"p99":>10}{"max":>10}  (ms)']
+        for path, latencies in self.latencies.items():
+            ordered = sorted(latencies)
+            lines.append(f'{path:>16}{len(ordered):>9}{statistics.fmean(ordered) * 1000:>10.3f}'
+                         + ''.join(f'{percentile(ordered, fraction) * 1000:>10.3f}' for fraction in (0.5, 0.9, 0.99))
+                         + f'{ordered[-1] * 1000:>10.3f}')
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game message and game management hot paths.')
+    parser.add_argument('-n', '--games', type=int, default=200, help='number of complete games to play')
+    parser.add_argument('-c', '--concurrency', type=int, default=20, help='games played at the same time')
+    parser.add_argument('--deadline-games', type=int, default=200, help='games whose deadlines are expired in one batch')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the numbers, coin tosses and stoppage time')
+    parser.add_argument('--sqlite', action='store_true', help='use the embedded SQLite backend, in a temporary file')
+    parser.add_argument('--query-latency', type=float, default=0.0, help='milliseconds added to every query of the in-process database')
+    parser.add_argument('--send-latency', type=float, default=0.0, help='milliseconds added to every Discord message sent')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of the same workload, of which the fastest is reported')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for run in range(args.repeat):
+            random.seed(args.seed)
+            benchmark = Benchmark(args.games, args.concurrency, args.deadline_games, args.seed,
+                                  query_latency=args.query_latency / 1000, send_latency=args.send_latency / 1000,
+                                  sqlite=os.path.join(directory, f'run{run}.db') if args.sqlite else None)
+            # Collections in the middle of a run are the biggest source of noise between runs
+            gc.collect()
+            gc.freeze()
+            asyncio.run(benchmark.run())
+            gc.unfreeze()
+            runs.append(benchmark)
+    fastest = min(runs, key=lambda run: run.elapsed)
+    print(f'Fastest of {len(runs)} runs ({", ".join(f"{run.elapsed:.2f}s" for run in runs)})')
+    print(fastest.report())
+
+
+if __name__ == '__main__':
+    main()
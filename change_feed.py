@@ -0,0 +1,180 @@
+"""
+PostgreSQL LISTEN/NOTIFY change feed for the Fake Soccer Bot's caches
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from asyncpg import Connection, Pool
+
+from discord_db_client import Bot
+from game_cache import GameCache
+from team_cache import TeamCache
+
+
+# Installed on every startup, so it has to be safe to run more than once
+NOTIFY_TRIGGERS = """
+CREATE OR REPLACE FUNCTION notify_games_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('games_changed', OLD.gameid::text);
+    ELSE
+        PERFORM pg_notify('games_changed', NEW.gameid::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_teams_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('teams_changed', OLD.teamid);
+    ELSE
+        PERFORM pg_notify('teams_changed', NEW.teamid);
+        IF TG_OP = 'UPDATE' AND OLD.teamid != NEW.teamid THEN
+            PERFORM pg_notify('teams_changed', OLD.teamid);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS games_changed ON games;
+CREATE TRIGGER games_changed AFTER INSERT OR UPDATE OR DELETE ON games
+    FOR EACH ROW EXECUTE PROCEDURE notify_games_changed();
+
+DROP TRIGGER IF EXISTS teams_changed ON teams;
+CREATE TRIGGER teams_changed AFTER INSERT OR UPDATE OR DELETE ON teams
+    FOR EACH ROW EXECUTE PROCEDURE notify_teams_changed();
+"""
+
+# Wait between attempts to restart the feed after its connection was lost
+RECONNECT_SECONDS = 60
+
+logger = logging.getLogger('fakeSoccerBot')
+
+
+class ChangeFeed:
+    """Listens for row changes on the games and teams tables and patches only the affected cache entries.
+
+    Notifications are queued and applied one at a time by a single task, in the order they arrived, so a game or
+    team is never reloaded by two notifications at once. If the connection is lost, the feed restarts itself and
+    then reloads both caches, since notifications sent in the meantime are gone."""
+    def __init__(self, bot: Bot, games: GameCache, teams: TeamCache):
+        self.bot = bot
+        self.games = games
+        self.teams = teams
+        self.connection: Optional[Connection] = None
+        self.queue: 'asyncio.Queue[Tuple[str, str]]' = asyncio.Queue()
+        self._consumer: Optional[asyncio.Task] = None
+        self._reconnecting: Optional[asyncio.Task] = None
+
+    @property
+    def supported(self) -> bool:
+        """Only PostgreSQL has notifications. An embedded database is only ever written to by this bot, so it needs none."""
+        return isinstance(self.bot.db, Pool)
+
+    @property
+    def listening(self) -> bool:
+        return self.connection is not None and not self.connection.is_closed()
+
+    async def start(self):
+        """Installs the notification triggers and holds a dedicated pool connection to listen on."""
+        if self.listening or not self.supported:
+            return
+        await self.stop()
+        connection = await self.bot.db.acquire()
+        try:
+            async with connection.transaction():
+                await connection.execute(NOTIFY_TRIGGERS)
+            await connection.add_listener('games_changed', self._on_notification)
+            await connection.add_listener('teams_changed', self._on_notification)
+            connection.add_termination_listener(self._on_termination)
+        except Exception:
+            await self.bot.db.release(connection)
+            raise
+        self.connection = connection
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def stop(self):
+        """Stops listening. Notifications still queued are applied once the feed is started again."""
+        if self._reconnecting is not None and self._reconnecting is not asyncio.current_task():
+            self._reconnecting.cancel()
+            self._reconnecting = None
+        if self._consumer is not None:
+            self._consumer.cancel()
+            self._consumer = None
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        try:
+            connection.remove_termination_listener(self._on_termination)
+            await connection.remove_listener('games_changed', self._on_notification)
+            await connection.remove_listener('teams_changed', self._on_notification)
+        except Exception:
+            pass
+        await self.bot.db.release(connection)
+
+    def _on_termination(self, connection: Connection):
+        if connection is not self.connection:
+            return
+        logger.warning('The change feed lost its connection, restarting it')
+        self.connection = None
+        self._reconnecting = asyncio.create_task(self._reconnect(connection))
+
+    async def _reconnect(self, lost: Connection):
+        """Restarts the feed after its connection was lost, then reloads the caches to catch up on missed changes."""
+        try:
+            await self.bot.db.release(lost)
+        except Exception:
+            pass
+        while not self.listening:
+            try:
+                await self.start()
+            except Exception:
+                logger.exception(f'Could not restart the change feed, trying again in {RECONNECT_SECONDS} seconds')
+                await asyncio.sleep(RECONNECT_SECONDS)
+        try:
+            await self.games.reload()
+            await self.teams.reload()
+        except Exception:
+            logger.exception('Could not reload the caches after restarting the change feed')
+        self._reconnecting = None
+
+    def _on_notification(self, connection: Connection, pid: int, channel: str, payload: str):
+        self.queue.put_nowait((channel, payload))
+
+    async def _consume(self):
+        while True:
+            channel, payload = await self.queue.get()
+            await self._apply(channel, payload)
+
+    async def _apply(self, channel: str, payload: str):
+        try:
+            if channel == 'games_changed':
+                await self.games.on_change(int(payload))
+            else:
+                await self.teams.on_change(payload)
+        except Exception:
+            logger.exception(f'Could not apply {channel} notification for {payload}')
@@ -23,16 +23,35 @@ SOFTWARE.
 """
 
 import inspect
+import re
 
-import asyncpg.exceptions
+import asyncpg
 import nextcord
 from nextcord.ext import commands
 
+import queries
 import utils
 from discord_db_client import Bot
 from listener import DEFENSIVE_MESSAGE
+from outbox import Priority
+from writeup_pool import WriteupTemplateError, validate as validate_writeup
 
 RANGES_IMAGE_URL = 'https://cdn.discordapp.com/attachments/893913926218158131/986421969614430288/unknown.png'
+SEARCH_PAGE_SIZE = 15
+# Longest pattern bot operators can search teams with. Matching runs on the event loop, so a pattern that backtracks
+# badly stalls every game until it is done.
+MAX_TEAM_REGEX_LENGTH = 50
+
+
+def team_list_embed(title: str, teams, footer: str):
+    """Helper method for Teams cog that generates an embed listing (team id, team name) pairs."""
+    desc_string = '```\n'
+    for teamid, teamname in teams:
+        desc_string += f'{teamid.upper()}: {teamname}\n'
+    desc_string += '```'
+    embed = nextcord.Embed(title=title, description=desc_string, color=0)
+    embed.set_footer(text=footer)
+    return embed
 
 
 class Teams(commands.Cog):
@@ -44,7 +63,7 @@ class Teams(commands.Cog):
     async def team_info(self, ctx, team_id: str):
         """Gives info about a certain team."""
         team_id = team_id.lower()
-        team = await self.bot.db.fetchrow('SELECT * FROM teams WHERE teamid = $1', team_id)
+        team = await queries.fetchrow(self.bot.db, 'team_info', team_id)
         try:
             c = int(team['color'], 16)
         except TypeError:
@@ -60,16 +79,50 @@ class Teams(commands.Cog):
     @commands.command(name='teamlist', aliases=['listteams', 'teamids', 'listteamids'])
     async def team_list(self, ctx, page_number: int = 1):
         """Lists all teams and their IDs."""
-        # TODO: Add regex search for team_list by teamid
-        teams = await self.bot.db.fetch(f'SELECT teamname, teamid FROM teams ORDER BY teamid ASC LIMIT 10 OFFSET {(page_number-1)*10}')
+        teams = self.bot.get_cog('Listener').teams.page(page_number)
         if len(teams) == 0:
             return await ctx.reply('Error: Page number out of range.')
-        desc_string = '```\n'
-        for team in teams:
-            desc_string += f'{team["teamid"].upper()}: {team["teamname"]}\n'
-        desc_string += '```'
-        embed = nextcord.Embed(title='Team IDs', description=desc_string, color=0)
-        embed.set_footer(text=f'Page {page_number}')
+        await ctx.reply(embed=team_list_embed('Team IDs', teams, f'Page {page_number}'))
+
+    @commands.command(name='teamsearch', aliases=['searchteams', 'findteam'])
+    async def team_search(self, ctx, text: str, page_number: int = 1):
+        """Lists the teams whose ID starts with some text first, then the other teams whose ID or name contains it."""
+        await self.reply_team_matches(ctx, text, self.bot.get_cog('Listener').teams.search(text), page_number)
+
+    @commands.command(name='teamregex', aliases=['regexteams'])
+    @commands.has_role('bot operator')
+    async def team_regex(self, ctx, pattern: str, page_number: int = 1):
+        """Lists the teams whose ID or name matches a regular expression."""
+        if len(pattern) > MAX_TEAM_REGEX_LENGTH:
+            return await ctx.reply(f'Error: Regular expressions can be at most {MAX_TEAM_REGEX_LENGTH} characters long.')
+        try:
+            compiled = re.compile(pattern, re.IGNORECASE)
+        except re.error as error:
+            return await ctx.reply(f'Error: Invalid regular expression: {error}')
+        await self.reply_team_matches(ctx, pattern, self.bot.get_cog('Listener').teams.matching(compiled), page_number)
+
+    async def reply_team_matches(self, ctx, search: str, teams, page_number: int):
+        """Replies with a page of the (team id, team name) pairs a team search found."""
+        if len(teams) == 0:
+            return await ctx.reply('No teams match your search.')
+        page = teams[(page_number - 1) * 10:page_number * 10] if page_number > 0 else []
+        if len(page) == 0:
+            return await ctx.reply('Error: Page number out of range.')
+        await ctx.reply(embed=team_list_embed(f'Teams matching {search}', page, f'Page {page_number} of {(len(teams) + 9) // 10}'))
+
+    @commands.command(name='standings', aliases=['table', 'leaguetable'])
+    async def standings(self, ctx, page_number: int = 1):
+        """Shows the league standings. Scrimmages and abandoned games are not counted."""
+        standings = self.bot.get_cog('Listener').standings
+        rows = standings.page(page_number)
+        if len(rows) == 0:
+            return await ctx.reply('No games have been finished yet.' if page_number == 1 else 'Error: Page number out of range.')
+        lines = [f'{"#":>3} {"Team":<8}{"P":>4}{"W":>4}{"D":>4}{"L":>4}{"GF":>5}{"GA":>5}{"GD":>5}{"Pts":>5}']
+        for position, team in rows:
+            lines.append(f'{position:>3} {team.teamid.upper():<8}{team.played:>4}{team.won:>4}{team.drawn:>4}{team.lost:>4}'
+                         f'{team.goals_for:>5}{team.goals_against:>5}{team.goal_difference:>+5}{team.points:>5}')
+        embed = nextcord.Embed(title='Standings', description='```\n' + '\n'.join(lines) + '\n```', color=0)
+        embed.set_footer(text=f'Page {page_number} of {(len(standings) + 19) // 20}')
         await ctx.reply(embed=embed)
 
     @commands.command(name='createteam', aliases=['addteam'])
@@ -79,8 +132,9 @@ class Teams(commands.Cog):
         team_id = team_id.lower()
         if len(team_id) > 7:
             return await ctx.reply('Error: Team ID too long.')
-        query = 'INSERT INTO teams(teamid, teamname, manager, color) VALUES ($1, $2, $3, $4)'
-        await self.bot.write(query, team_id, team_name, member.id, color)
+        async with self.bot.transaction() as connection:
+            await queries.execute(connection, 'create_team', team_id, team_name, member.id, color)
+        self.bot.get_cog('Listener').teams.set(team_id, team_name, member.id)
         color = int(color, 16)
         new_role = await ctx.guild.create_role(name=team_name)
         await new_role.edit(color=color)
@@ -92,9 +146,12 @@ class Teams(commands.Cog):
     async def remove_team(self, ctx, teamid: str):
         """Deletes a team from the database."""
         # TODO: Automatically abandon games when the team is deleted.
-        userteam = await self.bot.db.fetchval('SELECT teamname FROM teams WHERE teamid = $1', teamid)
-        await self.bot.write('DELETE FROM teams WHERE teamid = $1', teamid)
-        role = (nextcord.utils.get(ctx.guild.roles, name=userteam))
+        async with self.bot.transaction() as connection:
+            userteam = await queries.fetchval(connection, 'delete_team', teamid)
+        if userteam is None:
+            return await ctx.reply('Error: Team not found.')
+        self.bot.get_cog('Listener').teams.remove(teamid)
+        role = self.bot.guild_index.role(ctx.guild, userteam)
         await role.delete()
         await ctx.reply(f'Success: Team {userteam} has been deleted.')
 
@@ -103,19 +160,22 @@ class Teams(commands.Cog):
     async def add_substitute(self, ctx, team_id: str, user: nextcord.Member):
         """Adds a substitute for a team."""
         team_id = team_id.lower()
-        team = await self.bot.db.fetchrow('SELECT teamname, manager, substitute FROM teams WHERE teamid = $1', team_id)
+        async with self.bot.transaction() as connection:
+            team = await queries.fetchrow(connection, 'lock_team', team_id)
+            if team is not None:
+                await queries.execute(connection, 'set_substitute', team_id, user.id)
         if team is not None:
-            await self.bot.write(f"UPDATE teams SET substitute = {user.id} WHERE teamid = '{team_id}'")
-            team_role = nextcord.utils.get(ctx.guild.roles, name=team['teamname'])
-            existing_coach = nextcord.utils.get(ctx.guild.members, id=team['manager'])
+            self.bot.get_cog('Listener').teams.set(team_id, team['teamname'], team['manager'], user.id)
+            team_role = self.bot.guild_index.role(ctx.guild, team['teamname'])
+            existing_coach = ctx.guild.get_member(team['manager'])
             if existing_coach:
                 await existing_coach.remove_roles(team_role)
             if team['substitute']:
-                existing_sub = nextcord.utils.get(ctx.guild.members, id=team['substitute'])
+                existing_sub = ctx.guild.get_member(team['substitute'])
                 if existing_sub:
                     await existing_sub.remove_roles(team_role)
             await user.add_roles(team_role)
-            await ctx.reply(f"{user.mention} you are now substitute manager of {team_role.mention}. Please give the bot at most a minute to refresh their cache.")
+            await ctx.reply(f"{user.mention} you are now substitute manager of {team_role.mention}.")
         else:
             return await ctx.reply("Error: Team not found.")
 
@@ -124,15 +184,18 @@ class Teams(commands.Cog):
     async def remove_substitute(self, ctx, team_id: str):
         """Removes a substitute (if there is any) and their team role, and reinstates the official manager."""
         team_id = team_id.lower()
-        team = await self.bot.db.fetchrow('SELECT teamname, manager, substitute FROM teams WHERE teamid = $1', team_id)
+        async with self.bot.transaction() as connection:
+            team = await queries.fetchrow(connection, 'lock_team', team_id)
+            if team is not None:
+                await queries.execute(connection, 'set_substitute', team_id, None)
         if team is not None:
-            await self.bot.write(f"UPDATE teams SET substitute = NULL WHERE teamid = '{team_id}'")
-            team_role = nextcord.utils.get(ctx.guild.roles, name=team['teamname'])
-            existing_coach = nextcord.utils.get(ctx.guild.members, id=team['manager'])
+            self.bot.get_cog('Listener').teams.set(team_id, team['teamname'], team['manager'])
+            team_role = self.bot.guild_index.role(ctx.guild, team['teamname'])
+            existing_coach = ctx.guild.get_member(team['manager'])
             if existing_coach:
                 await existing_coach.add_roles(team_role)
             if team['substitute']:
-                existing_sub = nextcord.utils.get(ctx.guild.members, id=team['substitute'])
+                existing_sub = ctx.guild.get_member(team['substitute'])
                 if existing_sub:
                     await existing_sub.remove_roles(team_role)
             await ctx.reply(f"Substitute for team {team_role.mention} has been removed.")
@@ -145,156 +208,99 @@ class GameManagement(commands.Cog, name='Game Management'):
     def __init__(self, bot: Bot):
         self.bot = bot
 
+    async def create_game(self, ctx, hometeam: str, awayteam: str, category: str, channel_name: str, isscrimmage: bool = False, overtimegame: bool = False):
+        """Creates a game channel and the game itself, and announces the start of the game. Returns the new channel, or None if the game could not be started."""
+        if hometeam == awayteam:
+            await ctx.reply('Error: Cannot start game with same two teams.')
+            return None
+
+        team_names = {team['teamid']: team['teamname'] for team in await queries.fetch(self.bot.db, 'team_names', hometeam, awayteam)}
+        if hometeam not in team_names or awayteam not in team_names:
+            await ctx.reply(f'Error: One or both of your teams does not exist. Run command {self.bot.command_prefix}teamlist for a list of teams.')
+            return None
+
+        games_category = self.bot.guild_index.category(ctx.guild, category)
+        channel = await ctx.guild.create_text_channel(channel_name, category=games_category)
+
+        home_role = self.bot.guild_index.role(ctx.guild, team_names[hometeam])
+        away_role = self.bot.guild_index.role(ctx.guild, team_names[awayteam])
+
+        async with self.bot.transaction() as connection:
+            game = await queries.fetchrow(connection, 'create_game', hometeam, awayteam, channel.id, home_role.id, away_role.id, isscrimmage, overtimegame)
+        self.bot.get_cog('Listener').games.store(game)
+
+        message = await self.bot.outbox.send(channel, RANGES_IMAGE_URL)
+        await message.pin()
+        self.bot.outbox.send(channel, f'Game has started between {home_role.mention} and {away_role.mention}\n\n'
+                                      f'{hometeam.upper()} 0-0 {awayteam.upper()} '
+                                      f'0:00\n\n'
+                                      f'{away_role.mention}, please call **heads** or **tails**.')
+        return channel
+
+    async def update_channel_game(self, ctx, query: str, *args):
+        """Runs a named UPDATE ... RETURNING * query on the game in the channel the command was used in, with the channel id as $1.
+
+        Returns the updated game, or None after telling the user if the channel is not a game channel."""
+        async with self.bot.transaction() as connection:
+            game = await queries.fetchrow(connection, query, ctx.channel.id, *args)
+        if game is None:
+            await ctx.reply('Error: Channel does not appear to be game channel.')
+            return None
+        self.bot.get_cog('Listener').games.store(game)
+        return game
+
     @commands.command(name='startgame', aliases=['startmatch'])
     @commands.has_role('bot operator')
     async def start_game(self, ctx, hometeam: str, awayteam: str):
         """Starts a game between two teams from the database."""
         hometeam, awayteam = hometeam.lower(), awayteam.lower()
-
-        if hometeam == awayteam:
-            return await ctx.reply('Error: Cannot start game with same two teams.')
-
-        home_team_exists = await self.bot.db.fetchval('SELECT EXISTS(SELECT 1 FROM teams WHERE teamid = $1)', hometeam)
-        away_team_exists = await self.bot.db.fetchval('SELECT EXISTS(SELECT 1 FROM teams WHERE teamid = $1)', awayteam)
-
-        if home_team_exists and away_team_exists:
-            games_category = nextcord.utils.get(ctx.guild.categories, name='Game Threads')
-            channel = await ctx.guild.create_text_channel(f'{hometeam}-{awayteam}', category=games_category)
-
-            home_team_name = await self.bot.db.fetchval('SELECT teamname FROM teams WHERE teamid = $1', hometeam)
-            away_team_name = await self.bot.db.fetchval('SELECT teamname FROM teams WHERE teamid = $1', awayteam)
-
-            home_role = nextcord.utils.get(ctx.guild.roles, name=home_team_name)
-            away_role = nextcord.utils.get(ctx.guild.roles, name=away_team_name)
-
-            query = "INSERT INTO games(hometeam, awayteam, channelid, homeroleid, awayroleid, deadline) VALUES ($1, $2, $3, $4, $5, 'now'::timestamp + INTERVAL '1 day')"
-            await self.bot.write(query, hometeam, awayteam, channel.id, home_role.id, away_role.id)
-
-            gameid = await self.bot.db.fetchval(f"SELECT gameid FROM games WHERE hometeam = '{hometeam}' AND awayteam = '{awayteam}' ORDER BY gameid DESC")
-            listener_cog = self.bot.get_cog('Listener')
-            listener_cog.offcache[channel.id] = (gameid, hometeam, awayteam, 'AWAY', channel.id)
-
-            message = await channel.send(RANGES_IMAGE_URL)
-            await message.pin()
-            await channel.send(f'Game has started between {home_role.mention} and {away_role.mention}\n\n'
-                               f'{hometeam.upper()} 0-0 {awayteam.upper()} '
-                               f'0:00\n\n'
-                               f'{away_role.mention}, please call **heads** or **tails**.')
+        channel = await self.create_game(ctx, hometeam, awayteam, 'Game Threads', f'{hometeam}-{awayteam}')
+        if channel is not None:
             return await ctx.reply(f'Game successfully started in {channel.mention}.')
-        else:
-            return await ctx.reply(f'Error: One or both of your teams does not exist. Run command {self.bot.command_prefix}teamlist for a list of teams.')
 
     @commands.command(name='startscrim')
     @commands.has_role('bot operator')
     async def start_scrim(self, ctx, hometeam: str, awayteam: str):
         """Starts a scrimmage between two teams from the database."""
         hometeam, awayteam = hometeam.lower(), awayteam.lower()
-
-        if hometeam == awayteam:
-            return await ctx.reply('Error: Cannot start game with same two teams.')
-
-        home_team_exists = await self.bot.db.fetchval('SELECT EXISTS(SELECT 1 FROM teams WHERE teamid = $1)', hometeam)
-        away_team_exists = await self.bot.db.fetchval('SELECT EXISTS(SELECT 1 FROM teams WHERE teamid = $1)', awayteam)
-
-        if home_team_exists and away_team_exists:
-            games_category = nextcord.utils.get(ctx.guild.categories, name='scrimmages')
-            channel = await ctx.guild.create_text_channel(f'{hometeam}-{awayteam}-scrim', category=games_category)
-
-            home_team_name = await self.bot.db.fetchval('SELECT teamname FROM teams WHERE teamid = $1', hometeam)
-            away_team_name = await self.bot.db.fetchval('SELECT teamname FROM teams WHERE teamid = $1', awayteam)
-
-            home_role = nextcord.utils.get(ctx.guild.roles, name=home_team_name)
-            away_role = nextcord.utils.get(ctx.guild.roles, name=away_team_name)
-
-            query = "INSERT INTO games(hometeam, awayteam, channelid, homeroleid, awayroleid, deadline, isscrimmage) VALUES ($1, $2, $3, $4, $5, 'now'::timestamp + INTERVAL '1 day', true)"
-            await self.bot.write(query, hometeam, awayteam, channel.id, home_role.id, away_role.id)
-
-            gameid = await self.bot.db.fetchval(
-                f"SELECT gameid FROM games WHERE hometeam = '{hometeam}' AND awayteam = '{awayteam}' ORDER BY gameid DESC")
-            listener_cog = self.bot.get_cog('Listener')
-            listener_cog.offcache[channel.id] = (gameid, hometeam, awayteam, 'AWAY', channel.id)
-
-            message = await channel.send(RANGES_IMAGE_URL)
-            await message.pin()
-            await channel.send(f'Game has started between {home_role.mention} and {away_role.mention}\n\n'
-                               f'{hometeam.upper()} 0-0 {awayteam.upper()} '
-                               f'0:00\n\n'
-                               f'{away_role.mention}, please call **heads** or **tails**.')
+        channel = await self.create_game(ctx, hometeam, awayteam, 'scrimmages', f'{hometeam}-{awayteam}-scrim', isscrimmage=True)
+        if channel is not None:
             return await ctx.reply(f'Scrimmage successfully started in {channel.mention}.')
-        else:
-            return await ctx.reply(
-                f'Error: One or both of your teams does not exist. Run command {self.bot.command_prefix}teamlist for a list of teams.')
 
     @commands.command(name='startgameovertime', aliases=['startmatchovertime', 'startot'])
     @commands.has_role('bot operator')
     async def start_game_overtime(self, ctx, hometeam: str, awayteam: str):
         """Start a game with overtime rules using two teams from the database."""
         hometeam, awayteam = hometeam.lower(), awayteam.lower()
-
-        if hometeam == awayteam:
-            return await ctx.reply('Error: Cannot start game with same two teams.')
-
-        home_team_exists = await self.bot.db.fetchval('SELECT EXISTS(SELECT 1 FROM teams WHERE teamid = $1)', hometeam)
-        away_team_exists = await self.bot.db.fetchval('SELECT EXISTS(SELECT 1 FROM teams WHERE teamid = $1)', awayteam)
-
-        if home_team_exists and away_team_exists:
-            games_category = nextcord.utils.get(ctx.guild.categories, name='Game Threads')
-            channel = await ctx.guild.create_text_channel(f'{hometeam}-{awayteam}', category=games_category)
-
-            home_team_name = await self.bot.db.fetchval('SELECT teamname FROM teams WHERE teamid = $1', hometeam)
-            away_team_name = await self.bot.db.fetchval('SELECT teamname FROM teams WHERE teamid = $1', awayteam)
-
-            home_role = nextcord.utils.get(ctx.guild.roles, name=home_team_name)
-            away_role = nextcord.utils.get(ctx.guild.roles, name=away_team_name)
-
-            query = "INSERT INTO games(hometeam, awayteam, channelid, homeroleid, awayroleid, deadline, overtimegame) VALUES ($1, $2, $3, $4, $5, 'now'::timestamp + INTERVAL '1 day', true)"
-            await self.bot.write(query, hometeam, awayteam, channel.id, home_role.id, away_role.id)
-
-            gameid = await self.bot.db.fetchval(
-                f"SELECT gameid FROM games WHERE hometeam = '{hometeam}' AND awayteam = '{awayteam}' ORDER BY gameid DESC")
-            listener_cog = self.bot.get_cog('Listener')
-            listener_cog.offcache[channel.id] = (gameid, hometeam, awayteam, 'AWAY', channel.id)
-
-            message = await channel.send(RANGES_IMAGE_URL)
-            await message.pin()
-            await channel.send(f'Game has started between {home_role.mention} and {away_role.mention}\n\n'
-                               f'{hometeam.upper()} 0-0 {awayteam.upper()} '
-                               f'0:00\n\n'
-                               f'{away_role.mention}, please call **heads** or **tails**.')
+        channel = await self.create_game(ctx, hometeam, awayteam, 'Game Threads', f'{hometeam}-{awayteam}', overtimegame=True)
+        if channel is not None:
             return await ctx.reply(f'Game successfully started in {channel.mention}.')
-        else:
-            return await ctx.reply(
-                f'Error: One or both of your teams does not exist. Run command {self.bot.command_prefix}teamlist for a list of teams.')
 
     @commands.command(name='abandongame')
     @commands.has_role('bot operator')
     async def abandon_game(self, ctx):
         """Abandons a game in a channel."""
-        game = await self.bot.db.fetchrow(f'SELECT homeroleid, awayroleid, homescore, awayscore FROM games WHERE channelid = {ctx.channel.id}')
-        try:
-            home_role = nextcord.utils.get(ctx.guild.roles, id=game['homeroleid'])
-            away_role = nextcord.utils.get(ctx.guild.roles, id=game['awayroleid'])
-        except TypeError:
-            return await ctx.reply('Error: Channel does not appear to be game channel.')
-        await self.bot.write(f"UPDATE games SET gamestate = 'ABANDONED' WHERE channelid = {ctx.channel.id}")
-        scores_channel = nextcord.utils.get(ctx.guild.channels, name='scores')
-        await scores_channel.send(f'GAME ABANDONED: {home_role.mention} {game["homescore"]}-{game["awayscore"]} {away_role.mention}')
+        game = await self.update_channel_game(ctx, 'abandon_game')
+        if game is None:
+            return
+        home_role = ctx.guild.get_role(game['homeroleid'])
+        away_role = ctx.guild.get_role(game['awayroleid'])
+        scores_channel = self.bot.guild_index.channel(ctx.guild, 'scores')
+        self.bot.outbox.send(scores_channel, f'GAME ABANDONED: {home_role.mention} {game["homescore"]}-{game["awayscore"]} {away_role.mention}', priority=Priority.FEED)
         await ctx.reply('Game Abandoned. You may delete this channel at any time.')
 
     @commands.command(name='forceendgame', aliases=['stopgame', 'endgame'])
     @commands.has_role('bot operator')
     async def force_end_game(self, ctx):
         """Forces a game to end in a channel."""
-        game = await self.bot.db.fetchrow(f'SELECT homeroleid, awayroleid, homescore, awayscore FROM games WHERE channelid = {ctx.channel.id}')
-        try:
-            home_role = nextcord.utils.get(ctx.guild.roles, id=game['homeroleid'])
-            away_role = nextcord.utils.get(ctx.guild.roles, id=game['awayroleid'])
-        except TypeError:
-            return await ctx.reply('Error: Channel does not appear to be game channel.')
-        await self.bot.write(f"UPDATE games SET gamestate = 'FINAL' WHERE channelid = {ctx.channel.id}")
-        scores_channel = nextcord.utils.get(ctx.guild.channels, name='scores')
-        await scores_channel.send(
-            f'GAME ENDED EARLY: {home_role.mention} {game["homescore"]}-{game["awayscore"]} {away_role.mention}')
+        game = await self.update_channel_game(ctx, 'end_game')
+        if game is None:
+            return
+        home_role = ctx.guild.get_role(game['homeroleid'])
+        away_role = ctx.guild.get_role(game['awayroleid'])
+        scores_channel = self.bot.guild_index.channel(ctx.guild, 'scores')
+        self.bot.outbox.send(scores_channel, f'GAME ENDED EARLY: {home_role.mention} {game["homescore"]}-{game["awayscore"]} {away_role.mention}',
+                             priority=Priority.FEED)
         writeup = f'The game was ended early by a bot operator.\n\nAnd that\'s the end of the game!'
         if game['homescore'] > game['awayscore']:
             writeup += f' {home_role.mention} has defeated {away_role.mention} by a score of {game["homescore"]}-{game["awayscore"]}.'
@@ -309,16 +315,13 @@ class GameManagement(commands.Cog, name='Game Management'):
     @commands.has_role('bot operator')
     async def force_chew(self, ctx):
         """Toggles on or off force chew mode in a game channel."""
-        game = await self.bot.db.fetchrow(f'SELECT homeroleid, awayroleid, default_chew FROM games WHERE channelid = {ctx.channel.id}')
-        try:
-            home_role = nextcord.utils.get(ctx.guild.roles, id=game['homeroleid'])
-            away_role = nextcord.utils.get(ctx.guild.roles, id=game['awayroleid'])
-        except TypeError:
-            return await ctx.reply('Error: Channel does not appear to be game channel.')
-        if not game['default_chew']:
-            await self.bot.write(f'UPDATE games SET default_chew = true WHERE channelid = {ctx.channel.id}')
+        game = await self.update_channel_game(ctx, 'toggle_chew')
+        if game is None:
+            return
+        home_role = ctx.guild.get_role(game['homeroleid'])
+        away_role = ctx.guild.get_role(game['awayroleid'])
+        if game['default_chew']:
             return await ctx.reply(f'{home_role.mention} {away_role.mention} The game is now in chew only mode.')
-        await self.bot.write(f'UPDATE games SET default_chew = false WHERE channelid = {ctx.channel.id}')
         return await ctx.reply(f'{home_role.mention} {away_role.mention} The game is no longer in chew only mode.')
 
     @commands.command(name='addscore', aliases=['addgoal'])
@@ -328,14 +331,11 @@ class GameManagement(commands.Cog, name='Game Management'):
         arg = arg.lower()
         if arg not in ['home', 'away']:
             return await ctx.reply('Please specify home or away.')
-        game = await self.bot.db.fetchrow(f'SELECT homeroleid, awayroleid FROM games WHERE channelid = {ctx.channel.id}')
-        try:
-            home_role = nextcord.utils.get(ctx.guild.roles, id=game['homeroleid'])
-            away_role = nextcord.utils.get(ctx.guild.roles, id=game['awayroleid'])
-        except TypeError:
-            return await ctx.reply('Error: Channel does not appear to be game channel.')
-        await self.bot.write(f"UPDATE games SET {arg}score = {arg}score + 1 WHERE channelid = {ctx.channel.id}")
-        return await ctx.reply(f'{home_role.mention if arg == "home" else away_role.mention} has been granted one goal by a bot operator.')
+        game = await self.update_channel_game(ctx, f'add_{arg}_score')
+        if game is None:
+            return
+        role = ctx.guild.get_role(game[f'{arg}roleid'])
+        return await ctx.reply(f'{role.mention} has been granted one goal by a bot operator.')
 
     @commands.command(name='subtractscore', aliases=['subtractgoal'])
     @commands.has_role('bot operator')
@@ -344,40 +344,36 @@ class GameManagement(commands.Cog, name='Game Management'):
         arg = arg.lower()
         if arg not in ['home', 'away']:
             return await ctx.reply('Please specify home or away.')
-        game = await self.bot.db.fetchrow(f'SELECT homeroleid, awayroleid FROM games WHERE channelid = {ctx.channel.id}')
-        try:
-            home_role = nextcord.utils.get(ctx.guild.roles, id=game['homeroleid'])
-            away_role = nextcord.utils.get(ctx.guild.roles, id=game['awayroleid'])
-        except TypeError:
-            return await ctx.reply('Error: Channel does not appear to be game channel.')
-        await self.bot.write(f"UPDATE games SET {arg}score = {arg}score - 1 WHERE channelid = {ctx.channel.id}")
-        return await ctx.reply(f'{home_role.mention if arg == "home" else away_role.mention} has been removed of one goal by a bot operator.')
+        game = await self.update_channel_game(ctx, f'subtract_{arg}_score')
+        if game is None:
+            return
+        role = ctx.guild.get_role(game[f'{arg}roleid'])
+        return await ctx.reply(f'{role.mention} has been removed of one goal by a bot operator.')
 
     @commands.command(name='rerun')
     @commands.has_role('bot operator')
     async def rerun(self, ctx):
         """Reruns the play. Asks the defense for the defensive number again."""
-        game = await self.bot.db.fetchrow(f'SELECT hometeam, awayteam, homeroleid, awayroleid, homescore, awayscore, seconds, waitingon, def_off FROM games WHERE channelid = {ctx.channel.id}')
-        try:
-            home_role = nextcord.utils.get(ctx.guild.roles, id=game['homeroleid'])
-            away_role = nextcord.utils.get(ctx.guild.roles, id=game['awayroleid'])
-        except TypeError:
+        async with self.bot.transaction() as connection:
+            game = await queries.fetchrow(connection, 'lock_game_possession', ctx.channel.id)
+            if game is not None:
+                if game['def_off'] == 'DEFENSE':
+                    waitingon = game['waitingon']
+                else:
+                    waitingon = 'HOME' if game['waitingon'] == 'AWAY' else 'AWAY'
+                game = await queries.fetchrow(connection, 'rerun_play', ctx.channel.id, waitingon)
+        if game is None:
             return await ctx.reply('Error: Channel does not appear to be game channel.')
-        if game['def_off'] == 'DEFENSE':
-            waitingon = game['waitingon']
-        else:
-            waitingon = 'HOME' if game['waitingon'] == 'AWAY' else 'AWAY'
-        await self.bot.write(f"UPDATE games SET "
-                             f"def_off = 'DEFENSE', "
-                             f"waitingon = '{waitingon}' "
-                             f"WHERE channelid = {ctx.channel.id}")
         listener_cog = self.bot.get_cog('Listener')
+        listener_cog.games.store(game)
+        home_role = ctx.guild.get_role(game['homeroleid'])
+        away_role = ctx.guild.get_role(game['awayroleid'])
         defensive_user_id = await listener_cog.user_id_from_team(game['hometeam'] if waitingon == 'HOME' else game['awayteam'])
-        await self.bot.get_user(defensive_user_id).send(DEFENSIVE_MESSAGE.format(hometeam=game['hometeam'].upper(),
-                                                                                 awayteam=game['awayteam'].upper(),
-                                                                                 homescore=game['homescore'],
-                                                                                 awayscore=game['awayscore'],
-                                                                                 game_time=utils.seconds_to_time(game['seconds'])))
+        self.bot.outbox.send(self.bot.get_user(defensive_user_id), DEFENSIVE_MESSAGE.format(hometeam=game['hometeam'].upper(),
+                                                                                             awayteam=game['awayteam'].upper(),
+                                                                                             homescore=game['homescore'],
+                                                                                             awayscore=game['awayscore'],
+                                                                                             game_time=utils.seconds_to_time(game['seconds'])))
         return await ctx.reply(f'{home_role.mention} {away_role.mention} Current play is being rerun. Awaiting defensive number.')
 
 
@@ -396,50 +392,89 @@ class Writeups(commands.Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
 
+    def store(self, writeup_record: asyncpg.Record):
+        """Brings the writeup pool and search index up to date with a writeup that was added or changed."""
+        listener_cog = self.bot.get_cog('Listener')
+        listener_cog.writeups.set(writeup_record)
+        listener_cog.writeup_index.set(writeup_record)
+
     @commands.command(name='addwriteup')
     async def add_writeup(self, ctx, state: str, result: str, *, writeup_text: str):
         """Adds a writeup to the database."""
         state, result = state.upper(), result.upper()
         try:
-            await self.bot.write("INSERT INTO writeups(gamestate, result, writeuptext) VALUES ($1, $2, $3)", state, result, writeup_text)
-        except asyncpg.exceptions.InvalidTextRepresentationError:
+            validate_writeup(writeup_text)
+        except WriteupTemplateError as error:
+            return await ctx.reply(f"Error: {error}")
+        try:
+            async with self.bot.transaction() as connection:
+                writeup_record = await queries.fetchrow(connection, 'create_writeup', state, result, writeup_text)
+        except queries.InvalidValueError:
             return await ctx.reply("Error: either your gamestate, result, or both are not valid.")
-        writeup_record = await self.bot.db.fetchrow("SELECT * FROM writeups ORDER BY writeupid DESC LIMIT 1")
+        self.store(writeup_record)
         return await ctx.reply(content=f"Success: writeup saved with the id `{writeup_record['writeupid']}`.", embed=generate_writeup_embed(writeup_record))
 
     @commands.command(aliases=['writeup'])
     async def writeup_info(self, ctx, writeup_id: int):
         """Gives information about a writeup."""
-        writeup_record = await self.bot.db.fetchrow("SELECT * FROM writeups WHERE writeupid = $1", writeup_id)
+        writeup_record = await queries.fetchrow(self.bot.db, 'writeup', writeup_id)
         return await ctx.reply(embed=generate_writeup_embed(writeup_record))
 
     @commands.command(name='togglewriteup', aliases=['enablewriteup', 'disablewriteup'])
     async def toggle_writeup(self, ctx, writeup_id: int):
         """Toggles the writeup. Writeups with disabled = true will not appear in games."""
-        await self.bot.write("UPDATE writeups SET disabled = NOT disabled WHERE writeupid = $1", writeup_id)
-        writeup_record = await self.bot.db.fetchrow("SELECT * FROM writeups WHERE writeupid = $1", writeup_id)
+        async with self.bot.transaction() as connection:
+            writeup_record = await queries.fetchrow(connection, 'toggle_writeup', writeup_id)
         if writeup_record is None:
             return await ctx.reply("Error: writeup not found.")
+        self.store(writeup_record)
         return await ctx.reply(content=f"Success: writeup {'disabled' if writeup_record['disabled'] else 'enabled'}.", embed=generate_writeup_embed(writeup_record))
 
     @commands.command(name='searchwriteups')
     async def search_writeups(self, ctx, *, search_string: str):
-        matches = await self.bot.db.fetch("SELECT writeupid, gamestate, result FROM writeups WHERE to_tsvector(writeuptext) @@ to_tsquery($1)", search_string.replace(' ', ' & '))
+        """Searches writeups for words, best matches first. Words also match longer words that start with them.
+
+        Add state:<gamestate> or result:<result> to filter. The after:<score>/<id> the results end with shows the next page."""
+        filters, words = {}, []
+        for word in search_string.split():
+            name, _, value = word.partition(':')
+            if name.lower() in ('state', 'result', 'after') and value:
+                filters[name.lower()] = value.upper()
+            else:
+                words.append(word)
+        after = None
+        if 'after' in filters:
+            score, _, writeupid = filters['after'].partition('/')
+            try:
+                after = (float(score), int(writeupid))
+            except ValueError:
+                return await ctx.reply("Error: after: must be a score and a writeup id, like the one at the end of the previous results.")
+        query = ' '.join(words)
+        matches, more = self.bot.get_cog('Listener').writeup_index.search(query, gamestate=filters.get('state'), result=filters.get('result'),
+                                                                          after=after, limit=SEARCH_PAGE_SIZE)
         if not matches:
             return await ctx.reply("No writeups contain the requested string.")
-        matches.sort(key=lambda x: x['writeupid'])
-        content = f'**WRITEUPS THAT CONTAIN "{search_string}":**\n'
+        content = f'**WRITEUPS THAT CONTAIN "{query}":**\n'
         for match in matches:
-            content += f"{match['writeupid']}: {match['gamestate']}, {match['result']}\n"
+            snippet = match.text if len(match.text) <= 80 else f'{match.text[:77]}...'
+            content += f"{match.writeupid}: {match.gamestate}, {match.result}{' (disabled)' if match.disabled else ''} - {nextcord.utils.escape_markdown(snippet)}\n"
+        if more:
+            next_page = [f'{name}:{value}' for name, value in filters.items() if name != 'after'] + [f'after:{matches[-1].score!r}/{matches[-1].writeupid}', query]
+            content += f"\nMore results: `{self.bot.command_prefix}searchwriteups {' '.join(next_page)}`"
         await ctx.reply(content)
 
     @commands.command(name='editwriteup')
     async def edit_writeup(self, ctx, writeup_id: int, *, new_text: str):
         """Edits the text of the writeup."""
-        await self.bot.write("UPDATE writeups SET writeuptext = $1 WHERE writeupid = $2", new_text, writeup_id)
-        writeup_record = await self.bot.db.fetchrow("SELECT * FROM writeups WHERE writeupid = $1", writeup_id)
+        try:
+            validate_writeup(new_text)
+        except WriteupTemplateError as error:
+            return await ctx.reply(f"Error: {error}")
+        async with self.bot.transaction() as connection:
+            writeup_record = await queries.fetchrow(connection, 'edit_writeup', writeup_id, new_text)
         if writeup_record is None:
             return await ctx.reply("Error: writeup not found.")
+        self.store(writeup_record)
         return await ctx.reply(content=f"Success: writeup saved with the id `{writeup_record['writeupid']}`.", embed=generate_writeup_embed(writeup_record))
 
 
@@ -457,9 +492,40 @@ class Eval(commands.Cog):
             result = await result
         await ctx.reply(embed=nextcord.Embed(title='Eval', description=f'```py\n{result}\n```', color=0))
 
+class Stats(commands.Cog):
+    """Shows bot operators how the bot is performing."""
+    def __init__(self, bot: Bot):
+        self.bot = bot
+
+    @commands.command(name='stats')
+    @commands.has_role('bot operator')
+    async def stats(self, ctx):
+        """Shows how long game messages, commands and queries take, how much work is queued and how well the caches are doing."""
+        metrics = self.bot.metrics
+        sections = []
+        for title, family, limit in (('Listener paths', 'listener_seconds', None), ('Slowest commands', 'command_seconds', 5),
+                                     ('Slowest queries', 'query_seconds', 8)):
+            histograms = sorted(metrics.histograms[family].items(), key=lambda item: -item[1].percentile(0.99))[:limit]
+            lines = [f'{name[:28]:<28}{histogram.count:>7}{histogram.percentile(0.5) * 1000:>8.1f}{histogram.percentile(0.99) * 1000:>8.1f}'
+                     for name, histogram in histograms]
+            sections.append(f'{title:<28}{"count":>7}{"p50 ms":>8}{"p99 ms":>8}\n' + ('\n'.join(lines) or 'Nothing yet.'))
+        sections.append('Most run queries: ' + (', '.join(f'{name} {count}' for name, count in self.bot.queries.hits.most_common(5)) or 'none yet'))
+        queues = metrics.read('queue_depth')
+        sections.append('Queued: ' + ', '.join(f'{count} {name}' for name, count in queues.items()))
+        outbox = self.bot.outbox
+        sections.append(f'Outbox: {sum(outbox.sent.values())} sent, {sum(outbox.failed.values())} failed, {len(outbox.routes)} active routes')
+        sections.append('Cache hits: ' + ', '.join(f'{cache} {metrics.hit_rate(cache):.1%}'
+                                                   for cache in sorted(set(metrics.counters['cache_hits']) | set(metrics.counters['cache_misses']))))
+        listener_cog = self.bot.get_cog('Listener')
+        gate, games = listener_cog.gate, listener_cog.games
+        sections.append(f'Gate: {gate.accepted} accepted, {gate.dropped} dropped, '
+                        f'waiting on {len(games.waiting)} teams and {len(games.offense_channels)} game channels')
+        await ctx.reply(embed=nextcord.Embed(title='Stats', description='```\n' + '\n\n'.join(sections) + '\n```', color=0))
+
 
 def setup(bot: Bot):
     bot.add_cog(Teams(bot))
     bot.add_cog(GameManagement(bot))
     bot.add_cog(Writeups(bot))
     bot.add_cog(Eval(bot))
+    bot.add_cog(Stats(bot))
@@ -0,0 +1,180 @@
+"""
+In-process scheduler for the deadline warnings and expirations of the Fake Soccer Bot's games
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import nextcord
+
+from game_cache import GameState
+
+
+WARNING_BEFORE = datetime.timedelta(hours=12)
+RETRY_AFTER = datetime.timedelta(minutes=5)
+# Events due this close together are handled as one batch
+BATCH_WINDOW = datetime.timedelta(seconds=1)
+# Every time zone's offset from UTC is a multiple of this, so the database's offset can be rounded to it
+UTC_OFFSET_STEP = datetime.timedelta(minutes=15)
+# The heap is rebuilt without replaced events once it holds more than this many events per scheduled game, plus a few
+COMPACT_RATIO = 4
+COMPACT_MINIMUM = 64
+WARNING = 'WARNING'
+EXPIRED = 'EXPIRED'
+
+logger = logging.getLogger('fakeSoccerBot')
+
+Callback = Callable[[List[GameState]], Awaitable]
+
+
+class DeadlineScheduler:
+    """Fires the 12 hour warning and the expiry of every scheduled game's deadline at the exact time they are due.
+
+    Due events are kept in a heap ordered by time, and a single task sleeps until the earliest one. Scheduling a game
+    again replaces its events, so moving a deadline is just another call to schedule(); the replaced events stay in the
+    heap and are skipped when they come up. Warnings that are already past when a game is scheduled are not sent.
+
+    Everything that is due at about the same time, like the deadlines of a whole matchday, is passed to the callbacks
+    as one list, so it can be handled in bulk.
+
+    Deadlines are written with LOCALTIMESTAMP, so they are in the database's local time and have no timezone. They are
+    converted to UTC with utc_offset, which set_database_time() works out from the database's clock."""
+    def __init__(self, on_warning: Callback, on_expired: Callback):
+        self.on_warning = on_warning
+        self.on_expired = on_expired
+        self._heap: List[Tuple[datetime.datetime, int, int, str]] = []
+        self._scheduled: Dict[int, Tuple[datetime.datetime, int]] = {}
+        self._games: Dict[int, GameState] = {}
+        self._tokens = itertools.count()
+        self.utc_offset = datetime.timedelta()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def next_due(self) -> Optional[datetime.datetime]:
+        """Returns when the next event is due, not counting replaced events still in the heap."""
+        due = [when for when, token, gameid, _ in self._heap if self._current(gameid, token)]
+        return min(due, default=None)
+
+    def schedule(self, game: GameState):
+        """Schedules the warning and expiry of a game's deadline, replacing any events scheduled for an older deadline."""
+        if game.deadline is None:
+            return self.cancel(game)
+        self._games[game.gameid] = game
+        deadline = self.utc(game.deadline)
+        scheduled = self._scheduled.get(game.gameid)
+        if scheduled is not None and scheduled[0] == deadline:
+            return
+        token = next(self._tokens)
+        self._scheduled[game.gameid] = (deadline, token)
+        if deadline - WARNING_BEFORE > nextcord.utils.utcnow():
+            self._push(deadline - WARNING_BEFORE, token, game.gameid, WARNING)
+        self._push(deadline, token, game.gameid, EXPIRED)
+
+    def utc(self, deadline: datetime.datetime) -> datetime.datetime:
+        """Returns a deadline as an aware UTC time."""
+        if deadline.tzinfo is not None:
+            return deadline
+        return (deadline - self.utc_offset).replace(tzinfo=datetime.timezone.utc)
+
+    def set_database_time(self, database_time: datetime.datetime):
+        """Works out utc_offset from the database's LOCALTIMESTAMP, and moves the events of games already scheduled."""
+        offset = database_time - nextcord.utils.utcnow().replace(tzinfo=None)
+        offset = round(offset / UTC_OFFSET_STEP) * UTC_OFFSET_STEP
+        if offset == self.utc_offset:
+            return
+        self.utc_offset = offset
+        for game in list(self._games.values()):
+            self.schedule(game)
+
+    def cancel(self, game: GameState):
+        """Stops a game's events from firing, for when the game has finished."""
+        self._scheduled.pop(game.gameid, None)
+        self._games.pop(game.gameid, None)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _current(self, gameid: int, token: int) -> bool:
+        scheduled = self._scheduled.get(gameid)
+        return scheduled is not None and scheduled[1] == token
+
+    def _push(self, when: datetime.datetime, token: int, gameid: int, kind: str):
+        if len(self._heap) > COMPACT_RATIO * len(self._scheduled) + COMPACT_MINIMUM:
+            # Every scheduled game has at most a warning and an expiry in the heap, so most of it is replaced events
+            self._heap = [event for event in self._heap if self._current(event[2], event[1])]
+            heapq.heapify(self._heap)
+        heapq.heappush(self._heap, (when, token, gameid, kind))
+        if self._heap[0][1] == token:
+            # The new event is the earliest one, so the sleeping task has to recalculate how long to wait
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            while self._heap and not self._current(self._heap[0][2], self._heap[0][1]):
+                heapq.heappop(self._heap)
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = (self._heap[0][0] - nextcord.utils.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = {WARNING: [], EXPIRED: []}
+            until = nextcord.utils.utcnow() + BATCH_WINDOW
+            while self._heap and self._heap[0][0] <= until:
+                when, token, gameid, kind = heapq.heappop(self._heap)
+                if self._current(gameid, token):
+                    due[kind].append((self._games[gameid], token))
+            for kind, events in due.items():
+                if events:
+                    await self._fire(kind, events)
+
+    async def _fire(self, kind: str, events: List[Tuple[GameState, int]]):
+        try:
+            await (self.on_warning if kind == WARNING else self.on_expired)([game for game, _ in events])
+        except Exception:
+            logger.exception(f'Could not handle the {kind.lower()} deadlines of games {[game.gameid for game, _ in events]}')
+        if kind == EXPIRED:
+            for game, token in events:
+                if self._current(game.gameid, token):
+                    # Handled expiries either finish the game or move its deadline, so this one was not handled. Try
+                    # again later rather than leave the game stuck past its deadline.
+                    self._push(nextcord.utils.utcnow() + RETRY_AFTER, token, game.gameid, kind)
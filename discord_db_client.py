@@ -22,19 +22,51 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-from asyncpg import Pool
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Union
+
+from asyncpg import Connection, Pool
 from nextcord.ext import commands
 
+import metrics
+import queries
+from sqlite_db import SQLitePool
+from guild_index import GuildIndex
+from outbox import Outbox
+
 
 class Bot(commands.Bot):
-    """Represents both a connection to the PostgreSQL Client and Discord."""
+    """Represents both a connection to the database and Discord.
+
+    The database is either an asyncpg pool connected to PostgreSQL, or an embedded SQLite database from sqlite_db,
+    which has the same methods."""
     def __init__(self, **kwargs):
-        self.db: Pool = kwargs.pop('db')
+        self.db: Union[Pool, SQLitePool] = kwargs.pop('db')
+        self.queries = queries.registry
+        self.metrics = metrics.registry
+        self.outbox = Outbox()
+        self.guild_index = GuildIndex()
         super().__init__(**kwargs)
+        self.metrics.reading('outbox_queued', 'gauge', 'priority', 'Outgoing messages waiting to be sent.', self.outbox.depths)
+        self.metrics.reading('outbox_sent', 'counter', 'priority', 'Outgoing messages sent.', lambda: self.outbox.sent)
+        self.metrics.reading('outbox_failed', 'counter', 'priority', 'Outgoing messages that could not be sent.', lambda: self.outbox.failed)
+        for event in ('on_guild_role_create', 'on_guild_role_update', 'on_guild_role_delete', 'on_guild_channel_create',
+                      'on_guild_channel_update', 'on_guild_channel_delete', 'on_guild_remove'):
+            self.add_listener(getattr(self.guild_index, event), event)
+
+    async def invoke(self, ctx: commands.Context):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        with self.metrics.timer('command_seconds', ctx.command.qualified_name), \
+                self.queries.count_queries(f'command {ctx.command.qualified_name}'):
+            await super().invoke(ctx)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Connection]:
+        """Unit of work: yields a single pool connection inside a transaction.
 
-    async def write(self, query: str, *args):
-        """Write something to the database."""
-        connection = await self.db.acquire()
-        async with connection.transaction():
-            await self.db.execute(query, *args)
-        await self.db.release(connection)
+        The transaction is committed when the block exits and rolled back if it raises, and the connection is always
+        released back to the pool. Everything that has to happen atomically should use the yielded connection."""
+        async with self.db.acquire() as connection:
+            async with connection.transaction():
+                yield connection
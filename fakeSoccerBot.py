@@ -34,13 +34,16 @@ import asyncpg
 import nextcord
 from nextcord.ext import commands
 
+import queries
+import sqlite_db
 from discord_db_client import Bot
+from outbox import Priority
 
 
 async def login():
     """Logs into Discord and PostgreSQL and runs the bot."""
     # Sets up logging
-    logger = logging.Logger('fakeSoccerBot')
+    logger = logging.getLogger('fakeSoccerBot')
     nextcord_logger = logging.getLogger('nextcord')
     logger.setLevel(logging.INFO)
     nextcord_logger.setLevel(logging.INFO)
@@ -59,10 +62,24 @@ async def login():
     intents = nextcord.Intents.default()
     intents.members = True
     intents.message_content = True
-    db = await asyncpg.create_pool(**credentials['postgresql_creds'])
+    # Slow query log and per-event query limit
+    if 'slow_query_ms' in credentials:
+        queries.registry.slow_seconds = credentials['slow_query_ms'] / 1000
+    queries.registry.explain_slow = credentials.get('explain_slow_queries', False)
+    queries.registry.event_query_limit = credentials.get('event_query_limit', queries.EVENT_QUERY_LIMIT)
+
+    # Every registered query is prepared on each pool connection as it is opened
+    if credentials.get('database', 'postgresql') == 'sqlite':
+        db = await sqlite_db.create_pool(**credentials['sqlite_creds'], init=queries.registry.prepare)
+    else:
+        db = await asyncpg.create_pool(**credentials['postgresql_creds'], connection_class=queries.PreparedConnection,
+                                       init=queries.registry.prepare)
+    logger.info(f'Prepared {len(queries.registry.queries)} queries on each database connection')
 
     # Initializes bot object
     client = Bot(command_prefix='!', activity=activity, help_command=commands.MinimalHelpCommand(), intents=intents, db=db)
+    if credentials.get('metrics_file'):
+        client.loop.create_task(client.metrics.export(credentials['metrics_file']))
 
     @client.event
     async def on_ready():
@@ -80,10 +97,10 @@ async def login():
         print(exception, file=sys.stderr)
         if event == 'on_message':
             message: nextcord.Message = args[0]
-            log_channel = nextcord.utils.get(message.guild.channels, name='logs')
+            log_channel = client.guild_index.channel(message.guild, 'logs')
             errordesc = f'```py\n{exception}\n```'
             embed = nextcord.Embed(title='Error', description=errordesc, color=0)
-            await log_channel.send(content=f"Game error in channel {message.channel.mention}", embed=embed)
+            client.outbox.send(log_channel, f"Game error in channel {message.channel.mention}", priority=Priority.LOG, embed=embed)
 
     @client.event
     async def on_command_error(ctx, error):
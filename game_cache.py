@@ -0,0 +1,332 @@
+"""
+In-memory, write-through store of active games for the Fake Soccer Bot
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import itertools
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import game_engine
+import queries
+from discord_db_client import Bot
+from game_engine import Forfeit, Transition
+from queries import GAME_COLUMNS
+
+if TYPE_CHECKING:
+    from deadline_scheduler import DeadlineScheduler
+    from standings import Standings
+
+
+FINISHED_STATES = ('FINAL', 'ABANDONED', 'FORFEIT')
+
+
+class StaleGameError(Exception):
+    """Raised when a game could not be updated because it no longer is in the state the update was based on."""
+
+
+class GameState:
+    """A full row of the games table, kept in memory for as long as the game is active."""
+    __slots__ = GAME_COLUMNS
+
+    def __init__(self, **columns):
+        for column in GAME_COLUMNS:
+            setattr(self, column, columns.get(column))
+
+    @classmethod
+    def from_record(cls, record) -> 'GameState':
+        return cls(**{column: record[column] for column in GAME_COLUMNS})
+
+    def assign(self, record):
+        """Overwrites every column with the values from a games row."""
+        for column in GAME_COLUMNS:
+            setattr(self, column, record[column])
+
+    def __repr__(self):
+        return f'<GameState gameid={self.gameid} {self.hometeam}-{self.awayteam} {self.gamestate} {self.def_off} {self.waitingon}>'
+
+    @property
+    def finished(self) -> bool:
+        return self.gamestate in FINISHED_STATES
+
+    def team(self, side: str) -> str:
+        """Returns the team id playing on a side."""
+        return self.hometeam if side == 'HOME' else self.awayteam
+
+    def role_id(self, side: str) -> int:
+        """Returns the role id of the team playing on a side."""
+        return self.homeroleid if side == 'HOME' else self.awayroleid
+
+    def side_of(self, team_id: str) -> Optional[str]:
+        """Returns the side a team is playing on, or None if the team is not in this game."""
+        if team_id == self.hometeam:
+            return 'HOME'
+        if team_id == self.awayteam:
+            return 'AWAY'
+        return None
+
+
+class GameCache:
+    """Authoritative store of every active game, indexed by channel id, game id and the ids of the teams playing.
+
+    Every change to a cached game goes through update(), which writes it to PostgreSQL before applying it in memory,
+    so reads in the message hot path never need a round trip to the database. Changes made by anything else reach the
+    cache through on_change(), fed by the change feed. If a deadline scheduler is given, every game is scheduled with
+    it when it is cached or its deadline moves, and cancelled when it leaves the cache. If standings are given, every
+    game row stored in the cache is recorded in them, finished or not, so results reach the standings whichever way
+    a game ends.
+
+    The indexes also count the games waiting on each team and keep the channels of games waiting on an offensive
+    number, which the message gate reads. They are kept up to date as games change, so they never need rebuilding."""
+    def __init__(self, bot: Bot, deadlines: Optional['DeadlineScheduler'] = None, standings: Optional['Standings'] = None):
+        self.bot = bot
+        self.deadlines = deadlines
+        self.standings = standings
+        self.by_channel: Dict[int, GameState] = {}
+        self.by_id: Dict[int, GameState] = {}
+        self.by_team: Dict[str, Dict[int, GameState]] = {}
+        self.waiting: Dict[str, int] = {}
+        self.offense_channels: Set[int] = set()
+        self._echoes: Dict[int, int] = {}
+        # When each game was last assigned a row, on a clock that reads also take a reading from, so a row read before
+        # the last assignment can be recognised as older. Kept after games leave the cache, so an older row read
+        # before a game finished can not bring it back.
+        self._clock = itertools.count()
+        self._stamps: Dict[int, int] = {}
+
+    def __iter__(self) -> Iterator[GameState]:
+        return iter(list(self.by_id.values()))
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, channelid: int) -> Optional[GameState]:
+        return self.by_channel.get(channelid)
+
+    def get_by_id(self, gameid: int) -> Optional[GameState]:
+        return self.by_id.get(gameid)
+
+    def games_of(self, teamid: str) -> Tuple[GameState, ...]:
+        """Returns every active game a team is playing in."""
+        games = self.by_team.get(teamid)
+        return () if games is None else tuple(games.values())
+
+    def add(self, game: GameState):
+        self.by_channel[game.channelid] = game
+        self.by_id[game.gameid] = game
+        for team in (game.hometeam, game.awayteam):
+            self.by_team.setdefault(team, {})[game.gameid] = game
+        waiting = game.team(game.waitingon)
+        self.waiting[waiting] = self.waiting.get(waiting, 0) + 1
+        if game.def_off != 'DEFENSE':
+            self.offense_channels.add(game.channelid)
+        if self.deadlines is not None:
+            self.deadlines.schedule(game)
+
+    def remove(self, game: GameState):
+        self._unindex(game)
+        if self.deadlines is not None:
+            self.deadlines.cancel(game)
+
+    def _unindex(self, game: GameState):
+        if self.by_id.pop(game.gameid, None) is None:
+            return
+        self.by_channel.pop(game.channelid, None)
+        self.offense_channels.discard(game.channelid)
+        waiting = game.team(game.waitingon)
+        if self.waiting[waiting] == 1:
+            del self.waiting[waiting]
+        else:
+            self.waiting[waiting] -= 1
+        for team in (game.hometeam, game.awayteam):
+            games = self.by_team.get(team)
+            if games is not None:
+                games.pop(game.gameid, None)
+                if not games:
+                    del self.by_team[team]
+
+    def _assign(self, game: GameState, record):
+        """Updates a cached game in place from a games row, re-indexing it and dropping it once it has finished."""
+        self._unindex(game)
+        game.assign(record)
+        self._stamps[game.gameid] = next(self._clock)
+        if self.standings is not None:
+            self.standings.record(game)
+        if game.finished:
+            self.remove(game)
+        else:
+            self.add(game)
+
+    def store(self, record, since: Optional[int] = None) -> Optional[GameState]:
+        """Puts a games row into the cache, updating the cached game in place if there already is one.
+
+        Updating in place keeps references held by in-flight handlers valid. since is the reading of the clock taken
+        before the row was read from the database. If the game was assigned a row after that, the row is older than
+        what the cache has seen and is ignored, and the cached game (or None, if it has left the cache) is returned."""
+        if since is not None and self._stamps.get(record['gameid'], -1) > since:
+            return self.by_id.get(record['gameid'])
+        game = self.by_id.get(record['gameid'])
+        if game is None:
+            game = GameState.from_record(record)
+            self._stamps[game.gameid] = next(self._clock)
+            if self.standings is not None:
+                self.standings.record(game)
+            if not game.finished:
+                self.add(game)
+        else:
+            self._assign(game, record)
+        return game
+
+    async def reload(self):
+        """Reconciles the cache with every active game in the database.
+
+        Games that are no longer active are loaded once more, so a result that was missed still reaches the standings."""
+        since = next(self._clock)
+        records = await queries.fetch(self.bot.db, 'active_games')
+        seen = set()
+        for record in records:
+            self.store(record, since)
+            seen.add(record['gameid'])
+        for game in self:
+            if game.gameid not in seen:
+                await self.load(game.gameid)
+        self._echoes.clear()
+
+    async def load(self, gameid: int) -> Optional[GameState]:
+        """Loads a single game from the database into the cache and returns it."""
+        return await self._load('game_by_id', 'gameid', gameid)
+
+    async def load_channel(self, channelid: int) -> Optional[GameState]:
+        """Loads the game played in a channel from the database into the cache and returns it."""
+        return await self._load('game_by_channel', 'channelid', channelid)
+
+    async def _load(self, query: str, column: str, value: int) -> Optional[GameState]:
+        since = next(self._clock)
+        record = await queries.fetchrow(self.bot.db, query, value)
+        if record is None:
+            if column == 'gameid' and value in self.by_id:
+                self.remove(self.by_id[value])
+            return None
+        return self.store(record, since)
+
+    async def on_change(self, gameid: int):
+        """Handles a change notification for a game, skipping the ones caused by this cache's own writes."""
+        echoes = self._echoes.get(gameid, 0)
+        if echoes:
+            if echoes == 1:
+                del self._echoes[gameid]
+            else:
+                self._echoes[gameid] = echoes - 1
+            return
+        await self.load(gameid)
+
+    async def apply(self, game: GameState, transition: Transition):
+        """Writes a transition from the game engine through to the database and the cached game.
+
+        The transition was computed from the cached game, so the write only goes through if the gamestate and the side
+        the game is waiting on are still the same in the database. Scores and the clock are written as the new totals,
+        so the ones the transition changes have to be unchanged as well, or an operator's score change or a deadline
+        expiry that committed in the meantime would be overwritten."""
+        expect = {'gamestate': game.gamestate, 'waitingon': game.waitingon, 'def_off': game.def_off}
+        for column in ('homescore', 'awayscore', 'seconds'):
+            if column in transition.changes:
+                expect[column] = getattr(game, column)
+        await self.update(game, reset_deadline=transition.reset_deadline, expect=expect, **transition.changes)
+
+    async def update(self, game: GameState, reset_deadline: bool = False, expect: Optional[Dict[str, Any]] = None, **changes):
+        """Writes changes to a game through to the database in a single statement, then updates the cached game from the returned row.
+
+        If reset_deadline is true, the deadline is moved to one day from now by the database. If expect is given, the
+        write only goes through if those columns still hold those values, and StaleGameError is raised otherwise.
+        Games that reach a finished state are dropped from the cache.
+
+        The statement only depends on which columns are changed and checked, so each shape of update is registered
+        as its own named query the first time it is used and is prepared once per connection from then on."""
+        params = list(changes.values())
+        assignments = [f'{column} = ${index}' for index, column in enumerate(changes, start=1)]
+        if reset_deadline:
+            assignments.append("deadline = LOCALTIMESTAMP + INTERVAL '1 day'")
+        params.append(game.gameid)
+        conditions = [f'gameid = ${len(params)}']
+        for column, value in (expect or {}).items():
+            params.append(value)
+            conditions.append(f'{column} IS NOT DISTINCT FROM ${len(params)}')
+        query = f"UPDATE games SET {', '.join(assignments)} WHERE {' AND '.join(conditions)} RETURNING {', '.join(GAME_COLUMNS)}"
+
+        name = f"update_game({','.join(changes)}){'+deadline' if reset_deadline else ''}"
+        if expect:
+            name += f"?({','.join(expect)})"
+        if name not in queries.registry:
+            queries.add(name, query)
+
+        # The write will come back to us as a change notification, which must not reload the game
+        self._echoes[game.gameid] = self._echoes.get(game.gameid, 0) + 1
+        try:
+            record = await queries.fetchrow(self.bot.db, name, *params)
+        except Exception:
+            self._echoes[game.gameid] -= 1
+            raise
+        if record is None:
+            self._echoes[game.gameid] -= 1
+            await self.load(game.gameid)
+            raise StaleGameError(f'Game {game.gameid} changed in the database before it could be updated')
+        self._assign(game, record)
+
+    async def expire_deadlines(self, games: Iterable[GameState]) -> List[Tuple[GameState, Transition]]:
+        """Resolves the expired deadlines of a batch of games and returns the games that changed with their transitions.
+
+        Forfeits and delays of game are each written in a single statement for the whole batch. Games whose row no
+        longer matches the cached state or score, or whose deadline was moved in the meantime, are left alone and
+        reloaded."""
+        batches = {'forfeit_games': [], 'delay_games': []}
+        for game in games:
+            transition = game_engine.deadline_expired(game)
+            batches['forfeit_games' if transition.has(Forfeit) else 'delay_games'].append((game, transition))
+
+        applied = []
+        for query, batch in batches.items():
+            if not batch:
+                continue
+            params = ([], [], [], [], [], [], [], [], [], [])
+            for game, transition in batch:
+                row = {column: transition.changes.get(column, getattr(game, column))
+                       for column in ('gameid', 'homescore', 'awayscore', 'homedelays', 'awaydelays')}
+                row.update(gamestate=game.gamestate, waitingon=game.waitingon, def_off=game.def_off,
+                           homescore_was=game.homescore, awayscore_was=game.awayscore)
+                for column, value in zip(params, row.values()):
+                    column.append(value)
+                self._echoes[game.gameid] = self._echoes.get(game.gameid, 0) + 1
+            try:
+                records = await queries.fetch(self.bot.db, query, *params)
+            except Exception:
+                for game, _ in batch:
+                    self._echoes[game.gameid] -= 1
+                raise
+            updated = {record['gameid']: record for record in records}
+            for game, transition in batch:
+                record = updated.get(game.gameid)
+                if record is None:
+                    self._echoes[game.gameid] -= 1
+                    await self.load(game.gameid)
+                    continue
+                self._assign(game, record)
+                applied.append((game, transition))
+        return applied
@@ -0,0 +1,221 @@
+"""
+Game rules for the Fake Soccer Bot, as a state machine free of any database or Discord I/O
+
+Every function takes the current state of a game (anything with the columns of the games table as attributes, such as
+a GameState) and returns a Transition: the columns to change and the side effects the caller has to announce. The live
+bot writes the changes through the game cache.
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from enum import Enum
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from ranges import Results, resolve
+from utils import calculate_diff, extra_time_bell_curve
+
+
+class ClockUse(Enum):
+    """Enumeration representing the clock use action."""
+    HURRY = 1
+    NORMAL = 2
+    CHEW = 3
+
+
+CLOCK_SECONDS = {ClockUse.HURRY: 60, ClockUse.NORMAL: 75, ClockUse.CHEW: 90}
+
+# Results after which the team on offense has to defend next
+POSSESSION_CHANGES = frozenset((Results.GOAL, Results.TURNOVER_ATTACK, Results.TURNOVER_MIDFIELD, Results.TURNOVER_DEFENSE,
+                                Results.TURNOVER_FREE_KICK, Results.TURNOVER_PENALTY, Results.TURNOVER_BREAKAWAY))
+
+# Results that lead to a set piece, which is always played before stoppage time or the end of a half
+SET_PIECES = frozenset((Results.PENALTY_KICK, Results.FREE_KICK, Results.TURNOVER_FREE_KICK, Results.TURNOVER_PENALTY,
+                        Results.BREAKAWAY, Results.TURNOVER_BREAKAWAY))
+
+FIELD_POSITIONS = {
+    Results.GOAL: 'MIDFIELD',
+    Results.PENALTY_KICK: 'PENALTY',
+    Results.FREE_KICK: 'FREEKICK',
+    Results.ATTACK: 'ATTACK',
+    Results.MIDFIELD: 'MIDFIELD',
+    Results.DEFENSE: 'DEFENSE',
+    Results.BREAKAWAY: 'BREAKAWAY',
+    Results.TURNOVER_DEFENSE: 'DEFENSE',
+    Results.TURNOVER_MIDFIELD: 'MIDFIELD',
+    Results.TURNOVER_ATTACK: 'ATTACK',
+    Results.TURNOVER_FREE_KICK: 'FREEKICK',
+    Results.TURNOVER_BREAKAWAY: 'BREAKAWAY',
+    Results.TURNOVER_PENALTY: 'PENALTY',
+    Results.OPPOSING_GOAL: 'MIDFIELD'
+}
+
+HALF_SECONDS = 2700
+
+
+def opposite_side(side: str) -> str:
+    """Returns the other side of the field, 'HOME' or 'AWAY'."""
+    return 'AWAY' if side == 'HOME' else 'HOME'
+
+
+class StoppageTime(NamedTuple):
+    """Stoppage time for a half has started."""
+    half: int
+    minutes: int
+
+
+class Halftime(NamedTuple):
+    """The first half has ended. The second half starts at midfield with the given side on offense."""
+    kickoff: str
+
+
+class FullTime(NamedTuple):
+    """The game has ended."""
+
+
+class DelayOfGame(NamedTuple):
+    """A side took a delay of game and conceded a goal. The game restarts at midfield with that side on offense."""
+    side: str
+
+
+class Forfeit(NamedTuple):
+    """A side forfeited the game, either by running out of delays of game or by missing a deadline in a shootout."""
+    side: str
+    shootout: bool
+
+
+Effect = Any
+
+
+class Transition:
+    """The changes to a game's columns caused by one event, and the side effects the caller has to carry out."""
+    __slots__ = ('changes', 'reset_deadline', 'effects', 'outcome', 'diff', 'clock_use')
+
+    def __init__(self, changes: Dict[str, Any], reset_deadline: bool = True, effects: Optional[List[Effect]] = None,
+                 outcome: Optional[Results] = None, diff: Optional[int] = None, clock_use: Optional[ClockUse] = None):
+        self.changes = changes
+        self.reset_deadline = reset_deadline
+        self.effects = [] if effects is None else effects
+        self.outcome = outcome
+        self.diff = diff
+        self.clock_use = clock_use
+
+    def __repr__(self):
+        return f'<Transition {self.changes} effects={self.effects} outcome={self.outcome} diff={self.diff}>'
+
+    def has(self, effect_type) -> bool:
+        return any(isinstance(effect, effect_type) for effect in self.effects)
+
+
+def coin_toss(game, winner: str) -> Transition:
+    """The coin toss was called and won by winner, who now chooses to kick off or defer."""
+    return Transition({'gamestate': 'COIN_TOSS_CHOICE', 'waitingon': winner})
+
+
+def kickoff_choice(game, kick: bool) -> Transition:
+    """The winner of the coin toss chose to kick off now, or to defer and kick off the second half."""
+    kickoff = game.waitingon if kick else opposite_side(game.waitingon)
+    return Transition({'gamestate': 'MIDFIELD', 'waitingon': opposite_side(kickoff), 'def_off': 'DEFENSE',
+                       'first_half_kickoff': kickoff})
+
+
+def defensive_number(game, number: int) -> Transition:
+    """The defense submitted their number, so the game now waits on the offense."""
+    return Transition({'def_off': 'OFFENSE', 'waitingon': opposite_side(game.waitingon), 'defnumber': number})
+
+
+def result_changes(game, outcome: Results, clock_use: ClockUse = ClockUse.NORMAL) -> Dict[str, Any]:
+    """Returns the columns changed by the offense getting a result: score, clock, field position and who defends next."""
+    offense = game.waitingon
+    homescore, awayscore = game.homescore, game.awayscore
+    if outcome is Results.GOAL:
+        homescore, awayscore = (homescore + 1, awayscore) if offense == 'HOME' else (homescore, awayscore + 1)
+    elif outcome is Results.OPPOSING_GOAL:
+        homescore, awayscore = (homescore, awayscore + 1) if offense == 'HOME' else (homescore + 1, awayscore)
+    return {'homescore': homescore,
+            'awayscore': awayscore,
+            'seconds': game.seconds + CLOCK_SECONDS[clock_use],
+            'gamestate': FIELD_POSITIONS[outcome],
+            'def_off': 'DEFENSE',
+            'waitingon': offense if outcome in POSSESSION_CHANGES else opposite_side(offense)}
+
+
+def play(game, offnumber: int, clock_use: ClockUse = ClockUse.NORMAL,
+         roll_extra_time: Callable[[], int] = extra_time_bell_curve) -> Transition:
+    """The offense submitted their number against the stored defensive number, resolving the play.
+
+    Also handles starting stoppage time, halftime and full time, which are only checked after plays that do not lead to
+    a set piece."""
+    if game.default_chew:
+        clock_use = ClockUse.CHEW
+    diff = calculate_diff(offnumber, game.defnumber)
+    outcome = resolve(game.gamestate, diff)
+    changes = result_changes(game, outcome, clock_use)
+    seconds = changes['seconds']
+    transition = Transition(changes, outcome=outcome, diff=diff, clock_use=clock_use)
+    if outcome in SET_PIECES:
+        return transition
+
+    extratime1 = 0 if game.extratime1 is None else game.extratime1
+    if seconds >= HALF_SECONDS and game.extratime1 is None:
+        minutes = roll_extra_time()
+        changes['extratime1'] = minutes
+        transition.effects.append(StoppageTime(1, minutes))
+    elif seconds >= HALF_SECONDS + extratime1 * 60 and not game.secondhalf:
+        changes.update(gamestate='MIDFIELD', def_off='DEFENSE', waitingon=game.first_half_kickoff, secondhalf=True,
+                       seconds=HALF_SECONDS + extratime1 * 60)
+        transition.effects.append(Halftime(opposite_side(game.first_half_kickoff)))
+    extratime2 = 0 if game.extratime2 is None else game.extratime2
+    if seconds >= 2 * HALF_SECONDS + extratime1 * 60 and game.extratime2 is None:
+        minutes = roll_extra_time()
+        changes['extratime2'] = minutes
+        transition.effects.append(StoppageTime(2, minutes))
+    elif seconds >= 2 * HALF_SECONDS + extratime1 * 60 + extratime2 * 60 and not game.overtimegame:
+        # TODO: Overtime games currently play on past the end of the second half
+        changes['gamestate'] = 'FINAL'
+        transition.effects.append(FullTime())
+    return transition
+
+
+def forfeit_score(game, forfeiting_side: str) -> Tuple[int, int]:
+    """Returns the (homescore, awayscore) of a forfeited game. Margins of more than two goals stand, otherwise the score becomes 3-0."""
+    if abs(game.awayscore - game.homescore) > 2:
+        return game.homescore, game.awayscore
+    return (0, 3) if forfeiting_side == 'HOME' else (3, 0)
+
+
+def deadline_expired(game) -> Transition:
+    """The side the game is waiting on missed their deadline.
+
+    They forfeit if the game is in a shootout or they have already used their delay of game, otherwise they concede a
+    goal and the game restarts at midfield with them on offense."""
+    side = game.waitingon
+    delays = game.homedelays if side == 'HOME' else game.awaydelays
+    delays_column = 'homedelays' if side == 'HOME' else 'awaydelays'
+    if game.gamestate == 'SHOOTOUT' or delays:
+        homescore, awayscore = forfeit_score(game, side)
+        return Transition({'gamestate': 'FORFEIT', 'homescore': homescore, 'awayscore': awayscore, delays_column: 3},
+                          reset_deadline=False, effects=[Forfeit(side, game.gamestate == 'SHOOTOUT')])
+    changes = {'gamestate': 'MIDFIELD', 'waitingon': opposite_side(side), 'def_off': 'DEFENSE', delays_column: delays + 1}
+    if side == 'HOME':
+        changes['awayscore'] = game.awayscore + 1
+    else:
+        changes['homescore'] = game.homescore + 1
+    return Transition(changes, effects=[DelayOfGame(side)])
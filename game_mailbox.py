@@ -0,0 +1,98 @@
+"""
+Per-game mailboxes that process each game's messages in order, and different games in parallel
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+
+# Most messages that can wait in a single game's mailbox
+MAILBOX_CAPACITY = 5
+
+logger = logging.getLogger('fakeSoccerBot')
+
+
+class Mailbox:
+    """The messages waiting to be processed for one game, and the task processing them."""
+    __slots__ = ('queue', 'task')
+
+    def __init__(self):
+        self.queue: Deque[Tuple[Any, ...]] = deque()
+        self.task: Optional[asyncio.Task] = None
+
+
+class GameMailboxes:
+    """Gives every game with messages waiting its own mailbox, processed by its own task.
+
+    Messages for a game are handled strictly one after another, in the order they were posted, so a handler always
+    sees the state left by the one before it. Different games never wait on each other. A mailbox only exists while
+    it has messages: its task finishes and the mailbox is released as soon as it is empty, so finished games hold
+    nothing. A full mailbox rejects new messages instead of queueing without bound."""
+    def __init__(self, handle: Callable[..., Awaitable], capacity: int = MAILBOX_CAPACITY):
+        self.handle = handle
+        self.capacity = capacity
+        self.mailboxes: Dict[int, Mailbox] = {}
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.mailboxes)
+
+    def depth(self, gameid: int) -> int:
+        mailbox = self.mailboxes.get(gameid)
+        return 0 if mailbox is None else len(mailbox.queue)
+
+    def post(self, gameid: int, *args) -> bool:
+        """Queues handle(*args) in a game's mailbox. Returns False if the mailbox is full and the message was rejected."""
+        mailbox = self.mailboxes.get(gameid)
+        if mailbox is None:
+            mailbox = self.mailboxes[gameid] = Mailbox()
+        if len(mailbox.queue) >= self.capacity:
+            self.rejected += 1
+            return False
+        mailbox.queue.append(args)
+        if mailbox.task is None:
+            mailbox.task = asyncio.create_task(self._run(gameid, mailbox))
+        return True
+
+    def close(self):
+        """Stops every mailbox, dropping the messages still waiting."""
+        for mailbox in self.mailboxes.values():
+            mailbox.queue.clear()
+            if mailbox.task is not None:
+                mailbox.task.cancel()
+        self.mailboxes.clear()
+
+    async def _run(self, gameid: int, mailbox: Mailbox):
+        try:
+            while mailbox.queue:
+                try:
+                    await self.handle(*mailbox.queue.popleft())
+                except Exception:
+                    logger.exception(f'Unhandled error processing a message for game {gameid}')
+        finally:
+            mailbox.task = None
+            if self.mailboxes.get(gameid) is mailbox:
+                del self.mailboxes[gameid]
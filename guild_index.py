@@ -0,0 +1,124 @@
+"""
+Name-indexed lookup of the roles, channels and categories of the guilds the Fake Soccer Bot is in
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Dict, List, Optional
+
+import nextcord
+
+import metrics
+
+
+class GuildNames:
+    """One guild's roles, channels and categories by name, as ids."""
+    __slots__ = ('roles', 'channels', 'categories')
+
+    def __init__(self, guild: nextcord.Guild):
+        self.roles: Dict[str, int] = {}
+        self.channels: Dict[str, int] = {}
+        self.categories: Dict[str, int] = {}
+        # Added in reverse, so the first object with a name wins like it does with nextcord.utils.get
+        for role in reversed(guild.roles):
+            self.roles[role.name] = role.id
+        for channel in reversed(guild.channels):
+            self.names_for(channel)[channel.name] = channel.id
+
+    def names_for(self, channel: nextcord.abc.GuildChannel) -> Dict[str, int]:
+        return self.categories if isinstance(channel, nextcord.CategoryChannel) else self.channels
+
+
+def channels_like(channel: nextcord.abc.GuildChannel) -> List[nextcord.abc.GuildChannel]:
+    """Returns the guild's categories if channel is a category, and its other channels if not."""
+    if isinstance(channel, nextcord.CategoryChannel):
+        return channel.guild.categories
+    return [other for other in channel.guild.channels if not isinstance(other, nextcord.CategoryChannel)]
+
+
+class GuildIndex:
+    """Finds roles, channels and categories by name in constant time, instead of scanning the guild's lists.
+
+    Each guild is indexed the first time it is looked up in, and kept current from the role and channel create, update
+    and delete gateway events. Names only point at ids, and the objects themselves are fetched from nextcord's own
+    id-keyed caches, so they are never stale. Lookups by id should use guild.get_role() and guild.get_channel()."""
+    def __init__(self):
+        self.guilds: Dict[int, GuildNames] = {}
+
+    def names(self, guild: nextcord.Guild) -> GuildNames:
+        names = self.guilds.get(guild.id)
+        metrics.registry.hit('guild_index', names is not None)
+        if names is None:
+            names = self.guilds[guild.id] = GuildNames(guild)
+        return names
+
+    def role(self, guild: nextcord.Guild, name: str) -> Optional[nextcord.Role]:
+        role_id = self.names(guild).roles.get(name)
+        return None if role_id is None else guild.get_role(role_id)
+
+    def channel(self, guild: nextcord.Guild, name: str) -> Optional[nextcord.abc.GuildChannel]:
+        channel_id = self.names(guild).channels.get(name)
+        return None if channel_id is None else guild.get_channel(channel_id)
+
+    def category(self, guild: nextcord.Guild, name: str) -> Optional[nextcord.CategoryChannel]:
+        category_id = self.names(guild).categories.get(name)
+        return None if category_id is None else guild.get_channel(category_id)
+
+    def _rename(self, names: Dict[str, int], guild_objects, before, after):
+        if before is not None and names.get(before.name) == before.id:
+            del names[before.name]
+            # Fall back to another object with the same name, if there is one
+            replacement = nextcord.utils.get(guild_objects, name=before.name)
+            if replacement is not None and replacement.id != before.id:
+                names[before.name] = replacement.id
+        if after is not None:
+            names.setdefault(after.name, after.id)
+
+    async def on_guild_role_create(self, role: nextcord.Role):
+        if role.guild.id in self.guilds:
+            self._rename(self.guilds[role.guild.id].roles, (), None, role)
+
+    async def on_guild_role_update(self, before: nextcord.Role, after: nextcord.Role):
+        if after.guild.id in self.guilds and before.name != after.name:
+            self._rename(self.guilds[after.guild.id].roles, after.guild.roles, before, after)
+
+    async def on_guild_role_delete(self, role: nextcord.Role):
+        if role.guild.id in self.guilds:
+            self._rename(self.guilds[role.guild.id].roles, role.guild.roles, role, None)
+
+    async def on_guild_channel_create(self, channel: nextcord.abc.GuildChannel):
+        names = self.guilds.get(channel.guild.id)
+        if names is not None:
+            self._rename(names.names_for(channel), (), None, channel)
+
+    async def on_guild_channel_update(self, before: nextcord.abc.GuildChannel, after: nextcord.abc.GuildChannel):
+        names = self.guilds.get(after.guild.id)
+        if names is not None and before.name != after.name:
+            self._rename(names.names_for(after), channels_like(after), before, after)
+
+    async def on_guild_channel_delete(self, channel: nextcord.abc.GuildChannel):
+        names = self.guilds.get(channel.guild.id)
+        if names is not None:
+            self._rename(names.names_for(channel), channels_like(channel), channel, None)
+
+    async def on_guild_remove(self, guild: nextcord.Guild):
+        self.guilds.pop(guild.id, None)
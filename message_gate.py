@@ -0,0 +1,51 @@
+"""
+Constant-time filter in front of the game message handlers
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import nextcord
+
+from game_cache import GameCache
+from team_cache import TeamCache
+
+
+class MessageGate:
+    """Drops every message that can not move a game on, using only dict and set lookups.
+
+    A message is let through if its author is the acting manager of a team an active game is waiting on, and it was
+    sent either by DM or in the channel of a game waiting on an offensive number. The game cache keeps the teams
+    being waited on and those channels up to date as games change, so the gate never rebuilds anything."""
+    def __init__(self, games: GameCache, teams: TeamCache):
+        self.games = games
+        self.teams = teams
+        self.accepted = 0
+        self.dropped = 0
+
+    def admits(self, message: nextcord.Message) -> bool:
+        """Returns whether a message could be for a game, counting it as accepted or dropped."""
+        if (message.guild is not None and message.channel.id not in self.games.offense_channels) \
+                or not any(team in self.games.waiting for team in self.teams.teams_of(message.author.id)):
+            self.dropped += 1
+            return False
+        self.accepted += 1
+        return True
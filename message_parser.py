@@ -0,0 +1,153 @@
+"""
+Single-pass parser for the messages managers send during a game
+
+Run `python message_parser.py` for a microbenchmark against the old chain of lower(), split() and `in` checks.
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import timeit
+from typing import NamedTuple, Optional, Tuple, Union
+
+from game_engine import ClockUse
+
+
+class Invalid(NamedTuple):
+    """The message can not be used, and the manager is told why."""
+    error: str
+
+
+class TossCall(NamedTuple):
+    """Heads or tails was called."""
+
+
+class KickoffChoice(NamedTuple):
+    """The winner of the coin toss chose to kick off now, or to defer to the second half."""
+    kick: bool
+
+
+class Number(NamedTuple):
+    """An offensive or defensive number, with the clock use asked for by the offense."""
+    number: int
+    clock_use: ClockUse = ClockUse.NORMAL
+
+
+Intent = Union[Invalid, TossCall, KickoffChoice, Number]
+TOSS_CALL, KICK, DEFER = TossCall(), KickoffChoice(True), KickoffChoice(False)
+HURRY, NORMAL, CHEW = ClockUse.HURRY, ClockUse.NORMAL, ClockUse.CHEW
+# Every intent a valid number can produce, and the errors, built once so parsing a message allocates as little as possible
+NUMBERS = {clock_use: (None,) + tuple(Number(value, clock_use) for value in range(1, 1001)) for clock_use in ClockUse}
+NO_NUMBERS = Invalid('No numbers were found in your message. Please try again.')
+MULTIPLE_NUMBERS = Invalid('Multiple numbers were found in your message.')
+OUT_OF_RANGE = Invalid('Error: Number out of range.')
+BOTH_CLOCK_USES = Invalid('Error: Both "hurry" and "chew" were found in your message. Please try again.')
+
+
+# Keywords match anywhere in the lowercased message, so "kickoff" still counts as kick, and only the keywords that
+# matter in the current gamestate are looked for. Numbers do not depend on case, so a message is only lowercased when
+# keywords have to be looked for.
+
+def toss_call(lowered: str) -> Intent:
+    if 'heads' not in lowered and 'tails' not in lowered:
+        return Invalid('Did not call heads or tails.')
+    return TOSS_CALL
+
+
+def kickoff_choice(lowered: str) -> Intent:
+    kick, defer = 'kick' in lowered, 'defer' in lowered
+    if kick and defer:
+        return Invalid('Error: Both "kick" and "defer" were found in your message. Please try again.')
+    if not kick and not defer:
+        return Invalid('Neither **kick** or **defer** were found in your message. Please try again.')
+    return KICK if kick else DEFER
+
+
+def number(content: str, offense: bool) -> Intent:
+    """The number in a message, and for the offense also whether they want to hurry or chew.
+
+    A bare number, the most common message, is answered without splitting it. Anything else is split once, and only
+    lowercased if the offense's number was found and its clock use has to be looked for."""
+    if content.isdecimal():
+        value = int(content)
+        return NUMBERS[NORMAL][value] if 1 <= value <= 1000 else OUT_OF_RANGE
+    found = [word for word in content.split() if word.isdecimal()]
+    if len(found) != 1:
+        return MULTIPLE_NUMBERS if found else NO_NUMBERS
+    value = int(found[0])
+    if not 1 <= value <= 1000:
+        return OUT_OF_RANGE
+    if not offense:
+        return NUMBERS[NORMAL][value]
+    lowered = content.lower()
+    hurry, chew = 'hurry' in lowered, 'chew' in lowered
+    if hurry and chew:
+        return BOTH_CLOCK_USES
+    return NUMBERS[HURRY if hurry else CHEW if chew else NORMAL][value]
+
+
+def parse_offense(content: str, gamestate: str) -> Intent:
+    """Parses a message from the team on offense, which is a coin toss call or kickoff choice before the game starts."""
+    if gamestate == 'COIN_TOSS':
+        return toss_call(content.lower())
+    if gamestate == 'COIN_TOSS_CHOICE':
+        return kickoff_choice(content.lower())
+    return number(content, offense=True)
+
+
+def parse_defense(content: str) -> Intent:
+    """Parses a defensive number."""
+    return number(content, offense=False)
+
+
+def _legacy_parse_offense(content: str) -> Tuple[Optional[int], ClockUse]:
+    """The checks process_offense used to make for a number, kept for the benchmark."""
+    offnumbers = [int(x) for x in content.split() if x.isdigit()]
+    if len(offnumbers) != 1 or not 1 <= offnumbers[0] <= 1000:
+        return None, ClockUse.NORMAL
+    if 'hurry' in content.lower() and 'chew' in content.lower():
+        return None, ClockUse.NORMAL
+    clock_mode = ClockUse.NORMAL
+    if 'hurry' in content.lower():
+        clock_mode = ClockUse.HURRY
+    if 'chew' in content.lower():
+        clock_mode = ClockUse.CHEW
+    return offnumbers[0], clock_mode
+
+
+SAMPLES = ('500', '742 chew', 'hurry 13', 'ok here goes 999 CHEW', 'lol what a goal',
+           'I think we should go with 250 and hurry up, the clock is running and we need a goal before halftime')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game message parser.')
+    parser.add_argument('-n', '--number', type=int, default=200000, help='messages parsed per sample')
+    parser.add_argument('--repeat', type=int, default=5, help='timings per sample, of which the fastest is reported')
+    args = parser.parse_args()
+    for sample in SAMPLES:
+        parsed = min(timeit.repeat(lambda: parse_offense(sample, 'MIDFIELD'), number=args.number, repeat=args.repeat)) / args.number
+        legacy = min(timeit.repeat(lambda: _legacy_parse_offense(sample), number=args.number, repeat=args.repeat)) / args.number
+        print(f'{sample[:40]!r:44} parser {parsed * 1e9:8.0f} ns   legacy {legacy * 1e9:8.0f} ns   {parse_offense(sample, "MIDFIELD")}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Latency histograms, counters and gauges for the Fake Soccer Bot, exported in the Prometheus text format
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+EXPORT_SECONDS = 15
+
+logger = logging.getLogger('fakeSoccerBot')
+
+
+class Histogram:
+    """Counts of observed latencies per bucket, with their sum."""
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def percentile(self, fraction: float) -> float:
+        """Estimates a percentile by interpolating inside the bucket it falls in, like Prometheus' histogram_quantile."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) - 1 else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-2]
+
+
+# A gauge or counter family is read when it is exported, from a callback returning its value for each label value
+Reading = Callable[[], Dict[str, float]]
+
+
+class Metrics:
+    """Every metric the bot keeps. Histograms and counters are grouped in families, each with a single label.
+
+    Recording is a couple of dict lookups and additions, so it is cheap enough for every message, command and query.
+    Families are named without the fakesoccer_ prefix, which is added on export."""
+    def __init__(self):
+        self.histograms: Dict[str, Dict[str, Histogram]] = {}
+        self.counters: Dict[str, Counter] = {}
+        self.readings: Dict[str, Tuple[str, str, str, Reading]] = {}
+        self.help: Dict[str, Tuple[str, str]] = {}
+
+    def histogram(self, family: str, label: str, help_text: str):
+        """Declares a histogram family, labelled by label."""
+        self.histograms.setdefault(family, {})
+        self.help[family] = (label, help_text)
+
+    def counter(self, family: str, label: str, help_text: str):
+        """Declares a counter family, labelled by label."""
+        self.counters.setdefault(family, Counter())
+        self.help[family] = (label, help_text)
+
+    def reading(self, family: str, kind: str, label: str, help_text: str, read: Reading):
+        """Declares a gauge or counter family whose values are read from elsewhere when exported, replacing any earlier one."""
+        self.readings[family] = (kind, label, help_text, read)
+
+    def read(self, family: str) -> Dict[str, float]:
+        """Returns the current values of a family declared with reading(), by label value."""
+        kind, label, help_text, read = self.readings[family]
+        return read()
+
+    def observe(self, family: str, value: str, seconds: float):
+        histograms = self.histograms[family]
+        histogram = histograms.get(value)
+        if histogram is None:
+            histogram = histograms[value] = Histogram()
+        histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, family: str, value: str) -> Iterator[None]:
+        """Observes how long the block took, whether or not it raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(family, value, time.perf_counter() - start)
+
+    def count(self, family: str, value: str, amount: int = 1):
+        self.counters[family][value] += amount
+
+    def hit(self, cache: str, hit: bool):
+        """Counts a lookup in one of the in-memory caches."""
+        self.counters['cache_hits' if hit else 'cache_misses'][cache] += 1
+
+    def hit_rate(self, cache: str) -> float:
+        hits, misses = self.counters['cache_hits'][cache], self.counters['cache_misses'][cache]
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        for family, histograms in self.histograms.items():
+            label, help_text = self.help[family]
+            name = f'fakesoccer_{family}'
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for value, histogram in sorted(histograms.items()):
+                value = escape(value)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{"+Inf" if bound == float("inf") else bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+        families: List[Tuple[str, str, str, str, Dict[str, float]]] = [
+            (family, 'counter', *self.help[family], counts) for family, counts in self.counters.items()]
+        for family, (kind, label, help_text, read) in self.readings.items():
+            try:
+                families.append((family, kind, label, help_text, read()))
+            except Exception:
+                logger.exception(f'Could not read the {family} metric')
+        for family, kind, label, help_text, values in families:
+            name = f'fakesoccer_{family}{"_total" if kind == "counter" else ""}'
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for value, amount in sorted(values.items()):
+                lines.append(f'{name}{{{label}="{escape(value)}"}} {amount}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Writes every metric to a file, replacing it at once so a scraper never reads half of it."""
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            file.write(self.render())
+        os.replace(temporary, path)
+
+    async def export(self, path: str, interval: float = EXPORT_SECONDS):
+        """Rewrites the metrics file every interval seconds, for the node exporter's textfile collector to pick up."""
+        while True:
+            try:
+                self.write(path)
+            except Exception:
+                logger.exception(f'Could not write metrics to {path}')
+            await asyncio.sleep(interval)
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Metrics()
+registry.histogram('listener_seconds', 'path', 'Time taken to handle a game message or a batch of deadlines.')
+registry.histogram('command_seconds', 'command', 'Time taken to run a command.')
+registry.histogram('query_seconds', 'query', 'Time taken by a named database query, including waiting for a connection.')
+registry.counter('cache_hits', 'cache', 'Lookups answered by an in-memory cache.')
+registry.counter('cache_misses', 'cache', 'Lookups an in-memory cache could not answer.')
+registry.counter('events', 'event', 'Discord events handled, by kind.')
+registry.counter('event_queries', 'event', 'Database queries run while handling Discord events, by kind of event.')
+registry.counter('events_over_query_limit', 'event', 'Discord events that ran more queries than the per-event limit.')
@@ -0,0 +1,171 @@
+"""
+Rate-limit-aware outbound message dispatcher for the Fake Soccer Bot
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter, deque
+from enum import IntEnum
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import nextcord
+
+
+logger = logging.getLogger('fakeSoccerBot')
+
+
+class Priority(IntEnum):
+    """Order in which queued messages are sent, lowest first."""
+    PLAY = 0     # Replies to plays in game channels and defensive number DMs
+    NOTICE = 1   # Deadline warnings and expiries
+    FEED = 2     # Posts to the scores channel
+    LOG = 3      # Posts to the logs channel
+
+
+# Discord allows 5 messages every 5 seconds per channel
+ROUTE_MESSAGES = 5
+ROUTE_SECONDS = 5.0
+# Most messages sent to Discord at once, across all routes
+MAX_IN_FLIGHT = 5
+
+
+class PriorityGate:
+    """Lets at most a fixed number of sends run at once, admitting waiters by priority and then in arrival order."""
+    def __init__(self, slots: int):
+        self.free = slots
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self.free and not self._waiters:
+            self.free -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was already handed to us, so pass it on
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.free += 1
+
+
+class Route:
+    """The queue of messages for one channel or user, and the times of its recent sends."""
+    __slots__ = ('queue', 'sent', 'task')
+
+    def __init__(self):
+        self.queue: List[Tuple[int, int, Any, asyncio.Future]] = []
+        self.sent: Deque[float] = deque(maxlen=ROUTE_MESSAGES)
+        self.task: Optional[asyncio.Task] = None
+
+    async def wait_for_bucket(self):
+        """Sleeps until another message can be sent without going over the route's rate limit."""
+        if len(self.sent) == ROUTE_MESSAGES:
+            delay = self.sent[0] + ROUTE_SECONDS - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self.sent.append(time.monotonic())
+
+
+class Outbox:
+    """Sends every outgoing message through a queue per destination, so a rate limited channel or DM only holds up its own messages.
+
+    Each route is drained by its own task, which paces sends to stay within the channel rate limit and is released
+    shortly after the route's queue is empty. Sends from all routes share a small number of slots that are handed out by
+    priority, so a burst of score feed posts never delays the reply to a live play."""
+    def __init__(self):
+        self.routes: Dict[int, Route] = {}
+        self.gate = PriorityGate(MAX_IN_FLIGHT)
+        self.sent = Counter()
+        self.failed = Counter()
+        self._order = itertools.count()
+
+    def depths(self) -> Dict[str, int]:
+        """Returns the number of queued messages at each priority."""
+        depths = Counter({priority.name: 0 for priority in Priority})
+        for route in self.routes.values():
+            depths.update(Priority(priority).name for priority, _, _, _ in route.queue)
+        return dict(depths)
+
+    def send(self, destination: nextcord.abc.Messageable, content: Optional[str] = None,
+             priority: Priority = Priority.PLAY, **kwargs) -> asyncio.Future:
+        """Queues a message and returns a future for the sent nextcord.Message. Any keyword arguments are passed on to send().
+
+        There is no need to await the future. Failures are logged either way."""
+        future = asyncio.get_running_loop().create_future()
+        # Mark failures as retrieved, since they are logged when they happen
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        route = self.routes.get(destination.id)
+        if route is None:
+            route = self.routes[destination.id] = Route()
+        heapq.heappush(route.queue, (priority, next(self._order), (destination, content, kwargs), future))
+        if route.task is None:
+            route.task = asyncio.create_task(self._drain(destination.id, route))
+        return future
+
+    def reply(self, message: nextcord.Message, content: Optional[str] = None,
+              priority: Priority = Priority.PLAY, **kwargs) -> asyncio.Future:
+        """Queues a reply to a message."""
+        return self.send(message.channel, content, priority, reference=message, **kwargs)
+
+    async def _drain(self, route_id: int, route: Route):
+        try:
+            while route.queue:
+                priority, _, (destination, content, kwargs), future = heapq.heappop(route.queue)
+                await route.wait_for_bucket()
+                await self.gate.acquire(priority)
+                try:
+                    message = await destination.send(content, **kwargs)
+                except Exception as error:
+                    self.failed[Priority(priority).name] += 1
+                    logger.exception(f'Could not send a {Priority(priority).name} message to {destination}')
+                    if not future.done():
+                        future.set_exception(error)
+                else:
+                    self.sent[Priority(priority).name] += 1
+                    if not future.done():
+                        future.set_result(message)
+                finally:
+                    self.gate.release()
+        finally:
+            route.task = None
+            # Keep the route around until its rate limit window has passed, so the next burst is paced as well
+            asyncio.get_running_loop().call_later(ROUTE_SECONDS, self._release, route_id, route)
+
+    def _release(self, route_id: int, route: Route):
+        if route.task is None and not route.queue and self.routes.get(route_id) is route:
+            del self.routes[route_id]
@@ -0,0 +1,154 @@
+"""
+Append-only log of every play in every game, written to the database in batches
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import datetime
+import logging
+from typing import List, Optional, Tuple
+
+from asyncpg import Pool
+
+from discord_db_client import Bot
+from game_engine import Transition
+
+
+# Installed on every startup, so it has to be safe to run more than once. sqlite_db bundles its own version.
+PLAYS_TABLE = """
+CREATE TABLE IF NOT EXISTS plays (
+    playid BIGSERIAL PRIMARY KEY,
+    gameid BIGINT NOT NULL,
+    offense TEXT NOT NULL,
+    offnumber INTEGER NOT NULL,
+    defnumber INTEGER NOT NULL,
+    diff INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    clock_use TEXT NOT NULL,
+    gamestate_before TEXT NOT NULL,
+    gamestate TEXT NOT NULL,
+    homescore INTEGER NOT NULL,
+    awayscore INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    played_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plays_gameid ON plays(gameid);
+"""
+PLAY_COLUMNS = ('gameid', 'offense', 'offnumber', 'defnumber', 'diff', 'outcome', 'clock_use', 'gamestate_before',
+                'gamestate', 'homescore', 'awayscore', 'seconds', 'played_at')
+
+# A batch is written every FLUSH_SECONDS, or as soon as FLUSH_PLAYS plays are waiting
+FLUSH_SECONDS = 5.0
+FLUSH_PLAYS = 500
+# Most plays kept while the database can not be written to, after which the oldest are dropped
+MAX_BUFFERED = 50000
+
+logger = logging.getLogger('fakeSoccerBot')
+
+
+class PlayLog:
+    """Records every play as a row of the plays table, for stats, replays and balancing.
+
+    Recording a play only appends it to a buffer in memory. A background task writes the buffer to the database with
+    a single COPY per batch, so plays never wait on the database. Plays that could not be written are kept and retried
+    with the next batch."""
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.buffer: List[Tuple] = []
+        self.written = 0
+        self.dropped = 0
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def record(self, game, offense: str, gamestate_before: str, offnumber: int, defnumber: int, transition: Transition):
+        """Logs a play, after the transition has been applied to the game."""
+        self.buffer.append((game.gameid, offense, offnumber, defnumber, transition.diff, transition.outcome.name,
+                            transition.clock_use.name, gamestate_before, game.gamestate, game.homescore, game.awayscore,
+                            game.seconds, datetime.datetime.now(datetime.timezone.utc)))
+        if len(self.buffer) >= FLUSH_PLAYS:
+            self._full.set()
+            if len(self.buffer) > MAX_BUFFERED:
+                # Dropping a whole batch at a time keeps this, and its log line, from happening on every play
+                self._trim(MAX_BUFFERED - FLUSH_PLAYS)
+
+    def _trim(self, limit: int):
+        """Drops the oldest plays beyond limit."""
+        dropped = len(self.buffer) - limit
+        if dropped > 0:
+            del self.buffer[:dropped]
+            self.dropped += dropped
+            logger.error(f'Dropped the {dropped} oldest unwritten plays')
+
+    async def start(self):
+        """Starts writing batches, and creates the plays table if needed.
+
+        Batches are written even if the table could not be created, as it may already exist. The error is raised
+        once the writer is running."""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        if isinstance(self.bot.db, Pool):
+            await self.bot.db.execute(PLAYS_TABLE)
+
+    async def stop(self):
+        """Stops the background task and writes whatever is left.
+
+        A batch the task was writing when it was cancelled is back in the buffer by the time the task has finished."""
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Writes every buffered play in one batch."""
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        try:
+            async with self.bot.db.acquire() as connection:
+                await connection.copy_records_to_table('plays', records=batch, columns=PLAY_COLUMNS)
+        except BaseException as error:
+            # Also put the batch back if the flush was cancelled part way through the copy
+            self.buffer[:0] = batch
+            if not isinstance(error, Exception):
+                raise
+            logger.exception(f'Could not write {len(batch)} plays, keeping them for the next batch')
+            self._trim(MAX_BUFFERED)
+            return
+        self.written += len(batch)
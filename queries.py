@@ -0,0 +1,264 @@
+"""
+Registry of the Fake Soccer Bot's named, parameterized and prepared SQL queries
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Union
+
+from asyncpg import Connection, Pool
+from asyncpg.exceptions import DataError, InvalidCachedStatementError
+from asyncpg.prepared_stmt import PreparedStatement
+
+import metrics
+
+
+GAME_COLUMNS = ('gameid', 'hometeam', 'awayteam', 'channelid', 'homeroleid', 'awayroleid',
+                'homescore', 'awayscore', 'seconds', 'extratime1', 'extratime2', 'secondhalf',
+                'gamestate', 'def_off', 'waitingon', 'defnumber', 'default_chew', 'first_half_kickoff',
+                'isscrimmage', 'overtimegame', 'homedelays', 'awaydelays', 'deadline')
+SELECT_GAME = f"SELECT {', '.join(GAME_COLUMNS)} FROM games"
+
+# A pool, or a single connection. Anything with acquire() is treated as a pool, which covers sqlite_db's as well
+Executor = Union[Pool, Connection]
+
+# Defaults for the slow query log and the per-event query limit, which can be changed on the registry
+SLOW_QUERY_SECONDS = 0.25
+EVENT_QUERY_LIMIT = 10
+
+logger = logging.getLogger('fakeSoccerBot')
+
+
+class InvalidValueError(ValueError):
+    """Raised when the database rejects a value given to a query, such as a gamestate that does not exist.
+
+    Both backends raise this, so callers do not have to know which driver is in use."""
+
+
+class EventQueries:
+    """The names of the queries run while handling one Discord event."""
+    __slots__ = ('event', 'names')
+
+    def __init__(self, event: str):
+        self.event = event
+        self.names: List[str] = []
+
+
+current_event: ContextVar[Optional[EventQueries]] = ContextVar('current_event', default=None)
+
+
+def call_site(depth: int = 3) -> str:
+    """Returns where the innermost depth frames outside this module are, innermost first.
+
+    Awaiting coroutines keep their callers' frames linked, so this also works after a query has been awaited."""
+    sites = []
+    frame = sys._getframe(1)
+    while frame is not None and len(sites) < depth:
+        if frame.f_code.co_filename != __file__:
+            sites.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return ' <- '.join(sites) or 'unknown'
+
+
+class PreparedConnection(Connection):
+    """asyncpg connection that holds on to the registry's prepared statements. Pass as connection_class to create_pool."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements: Dict[str, PreparedStatement] = {}
+
+
+class QueryRegistry:
+    """Named SQL queries that are prepared once on every pool connection, so their plans are reused across all games.
+
+    Values are always passed as parameters and never formatted into the SQL, so every call to a query has the same
+    text. The number of times each query has been run is kept in hits, and how long they took in the metrics registry.
+
+    Queries that take at least slow_seconds are logged with the code that ran them and their arguments, and with their
+    query plan if explain_slow is set. Queries run while handling an event are counted with count_queries(), and
+    events that run more than event_query_limit are logged."""
+    def __init__(self):
+        self.queries: Dict[str, str] = {}
+        self.hits = Counter()
+        self.slow_seconds = SLOW_QUERY_SECONDS
+        self.explain_slow = False
+        self.event_query_limit = EVENT_QUERY_LIMIT
+
+    def __contains__(self, name: str):
+        return name in self.queries
+
+    def add(self, name: str, sql: str) -> str:
+        """Registers a query under a name and returns the name."""
+        existing = self.queries.get(name)
+        if existing is not None and existing != sql:
+            raise ValueError(f'Query {name} is already registered with different SQL')
+        self.queries[name] = sql
+        return name
+
+    async def prepare(self, connection: PreparedConnection):
+        """Prepares every registered query on a connection. Used as the pool's init hook, so this happens at startup."""
+        for name, sql in self.queries.items():
+            connection.statements[name] = await connection.prepare(sql)
+
+    @contextmanager
+    def count_queries(self, event: str) -> Iterator[EventQueries]:
+        """Counts the queries run in the block, and in any task it starts, as the handling of one event."""
+        queries = EventQueries(event)
+        token = current_event.set(queries)
+        try:
+            yield queries
+        finally:
+            current_event.reset(token)
+            metrics.registry.count('events', event)
+            metrics.registry.count('event_queries', event, len(queries.names))
+            if len(queries.names) > self.event_query_limit:
+                metrics.registry.count('events_over_query_limit', event)
+                logger.warning(f'{event} ran {len(queries.names)} queries: {", ".join(queries.names)}')
+
+    async def _run(self, executor: Executor, method: str, name: str, args):
+        self.hits[name] += 1
+        event = current_event.get()
+        if event is not None:
+            event.names.append(name)
+        start = time.perf_counter()
+        if hasattr(executor, 'acquire'):
+            async with executor.acquire() as connection:
+                return await self._timed(connection, method, name, args, start)
+        return await self._timed(executor, method, name, args, start)
+
+    async def _timed(self, connection, method: str, name: str, args, start: float):
+        try:
+            result = await self._run_on(connection, method, name, args)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.registry.observe('query_seconds', name, elapsed)
+        if elapsed >= self.slow_seconds:
+            await self._log_slow(connection, name, args, elapsed)
+        return result
+
+    async def _log_slow(self, connection, name: str, args, elapsed: float):
+        message = f'Slow query {name} took {elapsed * 1000:.1f}ms, from {call_site()}, with arguments {repr(args)[:500]}'
+        if self.explain_slow:
+            # Plain EXPLAIN only plans the statement, so this is safe for writes. SQLite's equivalent has another name.
+            explain = getattr(connection, 'EXPLAIN', 'EXPLAIN')
+            try:
+                plan = await connection.fetch(f'{explain} {self.queries[name]}', *args)
+                message += '\n' + '\n'.join(' '.join(str(value) for value in row.values()) for row in plan)
+            except Exception as error:
+                message += f'\nCould not explain it: {error}'
+        logger.warning(message)
+
+    async def _run_on(self, connection, method: str, name: str, args):
+        statement = connection.statements.get(name)
+        if statement is None:
+            statement = connection.statements[name] = await connection.prepare(self.queries[name])
+        try:
+            return await getattr(statement, method)(*args)
+        except DataError as error:
+            raise InvalidValueError(error) from error
+        except InvalidCachedStatementError:
+            # The schema changed under the prepared statement, so prepare it again
+            statement = connection.statements[name] = await connection.prepare(self.queries[name])
+            return await getattr(statement, method)(*args)
+
+    async def fetch(self, executor: Executor, name: str, *args):
+        return await self._run(executor, 'fetch', name, args)
+
+    async def fetchrow(self, executor: Executor, name: str, *args):
+        return await self._run(executor, 'fetchrow', name, args)
+
+    async def fetchval(self, executor: Executor, name: str, *args):
+        return await self._run(executor, 'fetchval', name, args)
+
+    async def execute(self, executor: Executor, name: str, *args):
+        """Runs a query for its side effects. Prepared statements have no execute(), so any rows are discarded."""
+        await self._run(executor, 'fetch', name, args)
+
+
+registry = QueryRegistry()
+fetch = registry.fetch
+fetchrow = registry.fetchrow
+fetchval = registry.fetchval
+execute = registry.execute
+add = registry.add
+
+# Games
+add('active_games', f"{SELECT_GAME} WHERE gamestate != 'FINAL' AND gamestate != 'ABANDONED' AND gamestate != 'FORFEIT'")
+add('finished_games', "SELECT gameid, hometeam, awayteam, homescore, awayscore FROM games "
+                       "WHERE (gamestate = 'FINAL' OR gamestate = 'FORFEIT') AND isscrimmage = FALSE")
+add('game_by_id', f'{SELECT_GAME} WHERE gameid = $1')
+add('game_by_channel', f'{SELECT_GAME} WHERE channelid = $1 ORDER BY gameid DESC LIMIT 1')
+add('create_game', "INSERT INTO games(hometeam, awayteam, channelid, homeroleid, awayroleid, deadline, isscrimmage, overtimegame) "
+                   "VALUES ($1, $2, $3, $4, $5, LOCALTIMESTAMP + INTERVAL '1 day', $6, $7) RETURNING *")
+# The database's clock, which deadlines are written with
+add('database_time', 'SELECT LOCALTIMESTAMP AS database_time')
+add('abandon_game', "UPDATE games SET gamestate = 'ABANDONED' WHERE channelid = $1 RETURNING *")
+add('end_game', "UPDATE games SET gamestate = 'FINAL' WHERE channelid = $1 RETURNING *")
+add('toggle_chew', 'UPDATE games SET default_chew = NOT default_chew WHERE channelid = $1 RETURNING *')
+for _side in ('home', 'away'):
+    add(f'add_{_side}_score', f'UPDATE games SET {_side}score = {_side}score + 1 WHERE channelid = $1 RETURNING *')
+    add(f'subtract_{_side}_score', f'UPDATE games SET {_side}score = {_side}score - 1 WHERE channelid = $1 RETURNING *')
+# Deadline expiries for a batch of games, one row per game. Scores and delays are worked out by the game engine, and a
+# row is only updated if the game is still in the state and has the score they were worked out from, and its deadline
+# really has passed.
+_EXPIRY_ROWS = ("FROM unnest($1::bigint[], $2::int[], $3::int[], $4::int[], $5::int[], $6::text[], $7::text[], $8::text[], "
+                "$9::int[], $10::int[]) "
+                "AS expiry(gameid, homescore, awayscore, homedelays, awaydelays, gamestate, waitingon, def_off, homescore_was, awayscore_was) "
+                "WHERE games.gameid = expiry.gameid AND games.gamestate::text IS NOT DISTINCT FROM expiry.gamestate "
+                "AND games.waitingon::text IS NOT DISTINCT FROM expiry.waitingon AND games.def_off::text IS NOT DISTINCT FROM expiry.def_off "
+                "AND games.homescore = expiry.homescore_was AND games.awayscore = expiry.awayscore_was "
+                "AND games.deadline <= LOCALTIMESTAMP")
+_RETURNING_GAME = f"RETURNING {', '.join(f'games.{column}' for column in GAME_COLUMNS)}"
+add('forfeit_games', "UPDATE games SET gamestate = 'FORFEIT', homescore = expiry.homescore, awayscore = expiry.awayscore, "
+                     f"homedelays = expiry.homedelays, awaydelays = expiry.awaydelays {_EXPIRY_ROWS} {_RETURNING_GAME}")
+add('delay_games', "UPDATE games SET gamestate = 'MIDFIELD', def_off = 'DEFENSE', "
+                   "waitingon = CASE games.waitingon WHEN 'HOME' THEN 'AWAY' WHEN 'AWAY' THEN 'HOME' ELSE games.waitingon END, "
+                   "homescore = expiry.homescore, awayscore = expiry.awayscore, homedelays = expiry.homedelays, "
+                   "awaydelays = expiry.awaydelays, deadline = LOCALTIMESTAMP + INTERVAL '1 day' "
+                   f"{_EXPIRY_ROWS} {_RETURNING_GAME}")
+add('lock_game_possession', 'SELECT waitingon, def_off FROM games WHERE channelid = $1 FOR UPDATE')
+add('rerun_play', "UPDATE games SET def_off = 'DEFENSE', waitingon = $2 WHERE channelid = $1 RETURNING *")
+
+# Teams
+add('all_teams', 'SELECT teamname, teamid, substitute, manager FROM teams')
+add('team', 'SELECT teamname, teamid, substitute, manager FROM teams WHERE teamid = $1')
+add('team_info', 'SELECT * FROM teams WHERE teamid = $1')
+add('team_names', 'SELECT teamid, teamname FROM teams WHERE teamid = $1 OR teamid = $2')
+add('team_of_manager', 'SELECT teamid FROM teams WHERE manager = $1')
+add('acting_manager', 'SELECT CASE WHEN substitute IS NULL THEN manager ELSE substitute END FROM teams WHERE teamid = $1')
+add('create_team', 'INSERT INTO teams(teamid, teamname, manager, color) VALUES ($1, $2, $3, $4)')
+add('delete_team', 'DELETE FROM teams WHERE teamid = $1 RETURNING teamname')
+add('lock_team', 'SELECT teamname, manager, substitute FROM teams WHERE teamid = $1 FOR UPDATE')
+add('set_substitute', 'UPDATE teams SET substitute = $2 WHERE teamid = $1')
+
+# Writeups
+add('create_writeup', 'INSERT INTO writeups(gamestate, result, writeuptext) VALUES ($1, $2, $3) RETURNING *')
+add('writeup', 'SELECT * FROM writeups WHERE writeupid = $1')
+add('enabled_writeups', 'SELECT writeupid, gamestate, result, writeuptext, disabled FROM writeups WHERE disabled = FALSE')
+add('toggle_writeup', 'UPDATE writeups SET disabled = NOT disabled WHERE writeupid = $1 RETURNING *')
+add('edit_writeup', 'UPDATE writeups SET writeuptext = $2 WHERE writeupid = $1 RETURNING *')
+add('all_writeups', 'SELECT writeupid, gamestate, result, writeuptext, disabled FROM writeups')
@@ -24,7 +24,7 @@ SOFTWARE.
 
 
 from enum import Enum
-from typing import Dict
+from typing import Dict, Iterable, List, Tuple
 
 
 class Results(Enum):
@@ -46,6 +46,9 @@ class Results(Enum):
 
 
 RangeDict = Dict[int, Results]
+OutcomeTable = Tuple[Results, ...]
+
+MAX_DIFF = 500
 
 
 ATTACK: RangeDict = {
@@ -121,3 +124,48 @@ BREAKAWAY: RangeDict = {
     495: Results.TURNOVER_BREAKAWAY,
     500: Results.OPPOSING_GOAL
 }
+
+
+RANGES: Dict[str, RangeDict] = {
+    'ATTACK': ATTACK,
+    'MIDFIELD': MIDFIELD,
+    'DEFENSE': DEFENSE,
+    'FREEKICK': FREE_KICK,
+    'PENALTY': PENALTY,
+    'BREAKAWAY': BREAKAWAY
+}
+
+
+def compile_ranges(name: str, ranges: RangeDict) -> OutcomeTable:
+    """Expands a range dict into a tuple indexed directly by diff, checking that every diff from 0 to 500 has exactly one result."""
+    starts = list(ranges)
+    if not starts or starts[0] != 0:
+        raise ValueError(f'{name} ranges do not start at a diff of 0')
+    for previous, start in zip(starts, starts[1:]):
+        if start <= previous:
+            raise ValueError(f'{name} ranges overlap: {start} comes after {previous}')
+    if starts[-1] > MAX_DIFF:
+        raise ValueError(f'{name} ranges start a range past the maximum diff of {MAX_DIFF}')
+    table = []
+    for start, end, result in zip(starts, starts[1:] + [MAX_DIFF + 1], ranges.values()):
+        table.extend([result] * (end - start))
+    return tuple(table)
+
+
+OUTCOMES: Dict[str, OutcomeTable] = {state: compile_ranges(state, ranges) for state, ranges in RANGES.items()}
+
+
+def resolve(state: str, diff: int) -> Results:
+    """Returns the result of a play with the given diff from the given gamestate."""
+    return OUTCOMES[state][diff]
+
+
+def resolve_many(state: str, diffs: Iterable[int]) -> List[Results]:
+    """Returns the results of many plays from the same gamestate."""
+    table = OUTCOMES[state]
+    return [table[diff] for diff in diffs]
+
+
+def outcome_codes(state: str) -> Tuple[int, ...]:
+    """Returns the compiled table for a gamestate as Results values, for use as a lookup array in vectorized code."""
+    return tuple(result.value for result in OUTCOMES[state])
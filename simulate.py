@@ -0,0 +1,198 @@
+"""
+Vectorized Monte Carlo match simulator for the Fake Soccer Bot
+
+Plays many full matches at once with the same range tables, clock use and stoppage time rules as the live bot,
+so changes to ranges.py can be balanced before they ship. Run `python simulate.py --help` for options.
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import time
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from ranges import RANGES, Results, outcome_codes
+from utils import EXTRA_TIME_CURVE
+from game_engine import CLOCK_SECONDS, FIELD_POSITIONS, POSSESSION_CHANGES, SET_PIECES, ClockUse
+
+STATES = tuple(RANGES)
+FINAL = len(STATES)
+STATE_NAMES = STATES + ('FINAL',)
+MIDFIELD = STATES.index('MIDFIELD')
+HOME, AWAY = 0, 1
+
+# Lookup arrays, indexed by gamestate and diff or by Results value
+OUTCOME_TABLE = np.array([outcome_codes(state) for state in STATES], dtype=np.int8)
+NEXT_STATE = np.zeros(max(result.value for result in Results) + 1, dtype=np.int8)
+CHANGES_POSSESSION = np.zeros_like(NEXT_STATE, dtype=bool)
+IS_SET_PIECE = np.zeros_like(NEXT_STATE, dtype=bool)
+for _result in Results:
+    NEXT_STATE[_result.value] = STATES.index(FIELD_POSITIONS[_result])
+    CHANGES_POSSESSION[_result.value] = _result in POSSESSION_CHANGES
+    IS_SET_PIECE[_result.value] = _result in SET_PIECES
+EXTRA_TIME_ROLLS = np.array([roll for roll, _ in EXTRA_TIME_CURVE])
+EXTRA_TIME_MINUTES = np.array([minutes for _, minutes in EXTRA_TIME_CURVE])
+
+
+class SimulationResults:
+    """Aggregated results of a batch of simulated matches."""
+    def __init__(self):
+        self.games = 0
+        self.plays = 0
+        self.elapsed = 0.0
+        self.scores = Counter()
+        self.transitions = np.zeros((FINAL, FINAL + 1), dtype=np.int64)
+        self.outcomes = np.zeros(len(NEXT_STATE), dtype=np.int64)
+
+    @property
+    def games_per_second(self) -> float:
+        return self.games / self.elapsed if self.elapsed else 0.0
+
+    def goals_per_game(self) -> float:
+        return sum((home + away) * count for (home, away), count in self.scores.items()) / self.games
+
+    def report(self, top_scores: int = 10) -> str:
+        home_wins = sum(count for (home, away), count in self.scores.items() if home > away)
+        away_wins = sum(count for (home, away), count in self.scores.items() if away > home)
+        draws = self.games - home_wins - away_wins
+        lines = [f'{self.games} games, {self.plays} plays in {self.elapsed:.2f}s '
+                 f'({self.games_per_second:,.0f} games/s, {self.plays / self.elapsed if self.elapsed else 0:,.0f} plays/s)',
+                 f'Goals per game: {self.goals_per_game():.3f}',
+                 f'Plays per game: {self.plays / self.games:.1f}',
+                 f'Home wins: {home_wins / self.games:.2%}  Draws: {draws / self.games:.2%}  Away wins: {away_wins / self.games:.2%}',
+                 '',
+                 'Most common scores:']
+        for (home, away), count in self.scores.most_common(top_scores):
+            lines.append(f'  {home}-{away}: {count / self.games:.2%}')
+        lines += ['', 'Outcomes:']
+        for value in np.argsort(-self.outcomes):
+            if self.outcomes[value]:
+                lines.append(f'  {Results(int(value)).name}: {self.outcomes[value] / self.plays:.2%}')
+        lines += ['', 'State transitions (row: state before the play, column: state after):',
+                  ' ' * 10 + ''.join(f'{name:>10}' for name in STATE_NAMES)]
+        for index, name in enumerate(STATES):
+            row = self.transitions[index]
+            total = row.sum()
+            lines.append(f'{name:>10}' + ''.join(f'{(count / total if total else 0):>10.2%}' for count in row))
+        return '\n'.join(lines)
+
+
+def roll_extra_time(rng: np.random.Generator, size: int) -> np.ndarray:
+    """Vectorized utils.extra_time_bell_curve."""
+    return EXTRA_TIME_MINUTES[np.searchsorted(EXTRA_TIME_ROLLS, rng.integers(1, 1001, size))]
+
+
+def simulate(games: int, rng: np.random.Generator, hurry: float = 0.0, chew: float = 0.0,
+             results: Optional[SimulationResults] = None) -> SimulationResults:
+    """Plays a batch of full matches at once, with both teams picking uniformly random numbers.
+
+    hurry and chew are the chances that the offense uses that clock mode on a play."""
+    if results is None:
+        results = SimulationResults()
+    clock_seconds = np.array([CLOCK_SECONDS[ClockUse.HURRY], CLOCK_SECONDS[ClockUse.NORMAL], CLOCK_SECONDS[ClockUse.CHEW]])
+    clock_chances = np.array([hurry, 1.0 - hurry - chew, chew])
+    start = time.perf_counter()
+
+    state = np.full(games, MIDFIELD, dtype=np.int8)
+    first_half_kickoff = rng.integers(HOME, AWAY + 1, games).astype(np.int8)
+    offense = first_half_kickoff.copy()
+    score = np.zeros((games, 2), dtype=np.int16)
+    seconds = np.zeros(games, dtype=np.int32)
+    extratime1 = np.full(games, -1, dtype=np.int16)
+    extratime2 = np.full(games, -1, dtype=np.int16)
+    secondhalf = np.zeros(games, dtype=bool)
+    active = np.arange(games)
+
+    while active.size:
+        n = active.size
+        results.plays += n
+        previous_state = state[active]
+        diff = np.abs(rng.integers(1, 1001, n) - rng.integers(1, 1001, n))
+        diff = np.where(diff > 500, 1000 - diff, diff)
+        outcome = OUTCOME_TABLE[previous_state, diff]
+        results.outcomes += np.bincount(outcome, minlength=len(NEXT_STATE))
+
+        # game_engine.result_changes
+        side = offense[active]
+        play_seconds = seconds[active] + rng.choice(clock_seconds, n, p=clock_chances)
+        goal = outcome == Results.GOAL.value
+        opposing_goal = outcome == Results.OPPOSING_GOAL.value
+        score[active[goal], side[goal]] += 1
+        score[active[opposing_goal], 1 - side[opposing_goal]] += 1
+        next_offense = np.where(CHANGES_POSSESSION[outcome], 1 - side, side)
+        next_state = NEXT_STATE[outcome]
+
+        # Stoppage time, halftime and full time from game_engine.play, which are only checked outside of set pieces
+        open_play = ~IS_SET_PIECE[outcome]
+        et1, et2, in_second_half = extratime1[active], extratime2[active], secondhalf[active]
+        et1_minutes, et2_minutes = np.maximum(et1, 0) * 60, np.maximum(et2, 0) * 60
+        start_first_stoppage = open_play & (play_seconds >= 2700) & (et1 < 0)
+        halftime = open_play & ~start_first_stoppage & (play_seconds >= 2700 + et1_minutes) & ~in_second_half
+        start_second_stoppage = open_play & (play_seconds >= 5400 + et1_minutes) & (et2 < 0)
+        full_time = open_play & ~start_second_stoppage & (play_seconds >= 5400 + et1_minutes + et2_minutes)
+
+        extratime1[active[start_first_stoppage]] = roll_extra_time(rng, int(start_first_stoppage.sum()))
+        extratime2[active[start_second_stoppage]] = roll_extra_time(rng, int(start_second_stoppage.sum()))
+        next_state[halftime] = MIDFIELD
+        next_offense[halftime] = 1 - first_half_kickoff[active[halftime]]
+        play_seconds[halftime] = 2700 + et1_minutes[halftime]
+        secondhalf[active[halftime]] = True
+        next_state[full_time] = FINAL
+
+        np.add.at(results.transitions, (previous_state, next_state), 1)
+        state[active] = next_state
+        offense[active] = next_offense
+        seconds[active] = play_seconds
+        active = active[~full_time]
+
+    results.scores.update(zip(score[:, HOME].tolist(), score[:, AWAY].tolist()))
+    results.games += games
+    results.elapsed += time.perf_counter() - start
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate Fake Soccer matches using the live range tables.')
+    parser.add_argument('-n', '--games', type=int, default=100000, help='number of matches to play')
+    parser.add_argument('--batch', type=int, default=250000, help='matches played at once, to bound memory use')
+    parser.add_argument('--seed', type=int, default=None, help='random seed, for reproducible runs')
+    parser.add_argument('--hurry', type=float, default=0.0, help='chance the offense hurries on a play')
+    parser.add_argument('--chew', type=float, default=0.0, help='chance the offense chews on a play')
+    parser.add_argument('--top', type=int, default=10, help='number of most common scores to show')
+    args = parser.parse_args()
+    if args.hurry < 0 or args.chew < 0 or args.hurry + args.chew > 1:
+        parser.error('--hurry and --chew must be chances that add up to at most 1')
+
+    rng = np.random.default_rng(args.seed)
+    results = SimulationResults()
+    remaining = args.games
+    while remaining > 0:
+        batch = min(args.batch, remaining)
+        simulate(batch, rng, hurry=args.hurry, chew=args.chew, results=results)
+        remaining -= batch
+    print(results.report(top_scores=args.top))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+"""
+Embedded SQLite storage backend for the Fake Soccer Bot, for single-node leagues, test rigs and load testing
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import asyncio
+import json
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence
+
+from queries import InvalidValueError
+from ranges import RANGES, Results
+
+
+# Column names are kept in sync with the PostgreSQL schema, so every registered query runs unchanged on both
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS teams (
+    teamid TEXT PRIMARY KEY,
+    teamname TEXT NOT NULL,
+    manager INTEGER NOT NULL,
+    substitute INTEGER,
+    color TEXT
+);
+
+CREATE TABLE IF NOT EXISTS games (
+    gameid INTEGER PRIMARY KEY AUTOINCREMENT,
+    hometeam TEXT NOT NULL REFERENCES teams(teamid) ON UPDATE CASCADE,
+    awayteam TEXT NOT NULL REFERENCES teams(teamid) ON UPDATE CASCADE,
+    channelid INTEGER NOT NULL,
+    homeroleid INTEGER,
+    awayroleid INTEGER,
+    homescore INTEGER NOT NULL DEFAULT 0,
+    awayscore INTEGER NOT NULL DEFAULT 0,
+    seconds INTEGER NOT NULL DEFAULT 0,
+    extratime1 INTEGER,
+    extratime2 INTEGER,
+    secondhalf BOOLEAN NOT NULL DEFAULT FALSE,
+    gamestate TEXT NOT NULL DEFAULT 'COIN_TOSS',
+    def_off TEXT NOT NULL DEFAULT 'OFFENSE',
+    waitingon TEXT NOT NULL DEFAULT 'AWAY',
+    defnumber INTEGER,
+    default_chew BOOLEAN NOT NULL DEFAULT FALSE,
+    first_half_kickoff TEXT,
+    isscrimmage BOOLEAN NOT NULL DEFAULT FALSE,
+    overtimegame BOOLEAN NOT NULL DEFAULT FALSE,
+    homedelays INTEGER NOT NULL DEFAULT 0,
+    awaydelays INTEGER NOT NULL DEFAULT 0,
+    deadline TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS games_channelid ON games(channelid);
+CREATE INDEX IF NOT EXISTS games_active ON games(gamestate) WHERE gamestate NOT IN ('FINAL', 'ABANDONED', 'FORFEIT');
+
+CREATE TABLE IF NOT EXISTS plays (
+    playid INTEGER PRIMARY KEY AUTOINCREMENT,
+    gameid INTEGER NOT NULL,
+    offense TEXT NOT NULL,
+    offnumber INTEGER NOT NULL,
+    defnumber INTEGER NOT NULL,
+    diff INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    clock_use TEXT NOT NULL,
+    gamestate_before TEXT NOT NULL,
+    gamestate TEXT NOT NULL,
+    homescore INTEGER NOT NULL,
+    awayscore INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    played_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plays_gameid ON plays(gameid);
+
+CREATE TABLE IF NOT EXISTS writeups (
+    writeupid INTEGER PRIMARY KEY AUTOINCREMENT,
+    gamestate TEXT NOT NULL CHECK (gamestate IN ({', '.join(f"'{state}'" for state in RANGES)})),
+    result TEXT NOT NULL CHECK (result IN ({', '.join(f"'{result.name}'" for result in Results)})),
+    writeuptext TEXT NOT NULL,
+    disabled BOOLEAN NOT NULL DEFAULT FALSE
+);
+"""
+
+PRAGMAS = ('PRAGMA journal_mode = WAL', 'PRAGMA synchronous = NORMAL', 'PRAGMA foreign_keys = ON', 'PRAGMA busy_timeout = 5000')
+
+# Columns that PostgreSQL returns as something other than what SQLite stores them as
+BOOLEAN_COLUMNS = frozenset(('secondhalf', 'default_chew', 'isscrimmage', 'overtimegame', 'disabled'))
+TIMESTAMP_COLUMNS = frozenset(('deadline', 'played_at', 'database_time'))
+
+# PostgreSQL syntax used by the registered queries, and its SQLite equivalent. Timestamps are stored as UTC text.
+REWRITES = ((re.compile(r"LOCALTIMESTAMP \+ INTERVAL '(\d+) (\w+?)s?'"), r"datetime('now', '+\1 \2')"),
+            (re.compile(r'LOCALTIMESTAMP'), "datetime('now')"),
+            (re.compile(r'::\w+(\[\])?'), ''),
+            (re.compile(r'IS NOT DISTINCT FROM'), 'IS'),
+            (re.compile(r'\s+FOR UPDATE'), ''),
+            (re.compile(r'\$(\d+)'), r'?\1'))
+UNNEST = re.compile(r'unnest\(([^)]*)\) AS (\w+)\(([^)]*)\)')
+
+
+def translate(sql: str) -> str:
+    """Rewrites a query written for PostgreSQL into SQLite.
+
+    unnest() over array parameters becomes a subquery over json_each(), and array arguments are passed as JSON."""
+    def unnest(match: re.Match) -> str:
+        arrays = [array.strip() for array in match.group(1).split(',')]
+        columns = [column.strip() for column in match.group(3).split(',')]
+        values = ', '.join(f"json_extract({array}, '$[' || unnest_rows.key || ']') AS {column}" for array, column in zip(arrays, columns))
+        return f'(SELECT {values} FROM json_each({arrays[0]}) AS unnest_rows) AS {match.group(2)}'
+    sql = UNNEST.sub(unnest, sql)
+    for pattern, replacement in REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def convert_argument(value):
+    if isinstance(value, (list, tuple)):
+        return json.dumps(value)
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def record(cursor: sqlite3.Cursor, row: tuple) -> Dict[str, Any]:
+    """Row factory that returns rows as dicts, with the same types asyncpg would return them as."""
+    result = {}
+    for (column, *_), value in zip(cursor.description, row):
+        if value is not None:
+            if column in BOOLEAN_COLUMNS:
+                value = bool(value)
+            elif column in TIMESTAMP_COLUMNS:
+                value = datetime.fromisoformat(value)
+        result[column] = value
+    return result
+
+
+class SQLiteStatement:
+    """A registered query translated for SQLite. SQLite compiles and caches the statement itself on first use."""
+    __slots__ = ('connection', 'sql')
+
+    def __init__(self, connection: 'SQLiteConnection', sql: str):
+        self.connection = connection
+        self.sql = sql
+
+    async def fetch(self, *args) -> List[Dict[str, Any]]:
+        return await self.connection.run(self.sql, args, 'fetch')
+
+    async def fetchrow(self, *args) -> Optional[Dict[str, Any]]:
+        return await self.connection.run(self.sql, args, 'fetchrow')
+
+    async def fetchval(self, *args):
+        row = await self.fetchrow(*args)
+        return None if row is None else next(iter(row.values()))
+
+
+class SQLiteConnection:
+    """One SQLite connection with the asyncpg Connection methods the bot uses.
+
+    Each connection has its own thread, so queries never block the event loop, and the statements on a connection run
+    one at a time in the order they were made."""
+    EXPLAIN = 'EXPLAIN QUERY PLAN'
+
+    def __init__(self, path: str):
+        self.path = path
+        self.statements: Dict[str, SQLiteStatement] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._connection: Optional[sqlite3.Connection] = None
+
+    async def connect(self):
+        def connect():
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=512)
+            connection.row_factory = record
+            for pragma in PRAGMAS:
+                connection.execute(pragma)
+            return connection
+        self._connection = await self._call(connect)
+
+    def _call(self, function: Callable, *args) -> Awaitable:
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def is_closed(self) -> bool:
+        return self._connection is None
+
+    async def close(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            await self._call(connection.close)
+        self._executor.shutdown(wait=False)
+
+    async def prepare(self, sql: str) -> SQLiteStatement:
+        return SQLiteStatement(self, translate(sql))
+
+    async def run(self, sql: str, args: Sequence, method: str):
+        args = [convert_argument(arg) for arg in args]
+
+        def run():
+            cursor = self._connection.execute(sql, args)
+            if method == 'fetchrow':
+                row = cursor.fetchone()
+                cursor.close()
+                return row
+            if method == 'execute':
+                return f'{sql.split(None, 1)[0].upper()} {cursor.rowcount}'
+            return cursor.fetchall()
+        try:
+            return await self._call(run)
+        except sqlite3.IntegrityError as error:
+            # CHECK constraints stand in for PostgreSQL's enum types, so a failed one is a value PostgreSQL would reject
+            if str(error).startswith('CHECK constraint failed'):
+                raise InvalidValueError(error) from error
+            raise
+
+    async def fetch(self, query: str, *args) -> List[Dict[str, Any]]:
+        return await self.run(translate(query), args, 'fetch')
+
+    async def fetchrow(self, query: str, *args) -> Optional[Dict[str, Any]]:
+        return await self.run(translate(query), args, 'fetchrow')
+
+    async def fetchval(self, query: str, *args):
+        row = await self.fetchrow(query, *args)
+        return None if row is None else next(iter(row.values()))
+
+    async def execute(self, query: str, *args) -> str:
+        """Runs a query and returns a status like asyncpg does. Without arguments, query may hold several statements."""
+        if not args:
+            await self._call(self._connection.executescript, translate(query))
+            return 'OK'
+        return await self.run(translate(query), args, 'execute')
+
+    async def executemany(self, query: str, args: Iterable[Sequence]):
+        rows = [[convert_argument(arg) for arg in row] for row in args]
+        await self._call(self._connection.executemany, translate(query), rows)
+
+    async def copy_records_to_table(self, table: str, *, records: Iterable[Sequence], columns: Sequence[str]):
+        """Bulk inserts rows in a single transaction, which is SQLite's nearest equivalent to COPY."""
+        rows = [[convert_argument(value) for value in record] for record in records]
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+        def copy():
+            with self._connection:
+                self._connection.execute('BEGIN')
+                self._connection.executemany(query, rows)
+        await self._call(copy)
+
+    @asynccontextmanager
+    async def transaction(self):
+        # IMMEDIATE takes the write lock up front, so two transactions never deadlock upgrading from a read
+        await self._call(self._connection.execute, 'BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            await self._call(self._connection.execute, 'ROLLBACK')
+            raise
+        await self._call(self._connection.execute, 'COMMIT')
+
+
+class PoolAcquireContext:
+    """Return value of SQLitePool.acquire(), which like asyncpg's can be awaited or used with async with."""
+    def __init__(self, pool: 'SQLitePool'):
+        self.pool = pool
+        self.connection: Optional[SQLiteConnection] = None
+
+    def __await__(self):
+        return self.pool.idle.get().__await__()
+
+    async def __aenter__(self) -> SQLiteConnection:
+        self.connection = await self.pool.idle.get()
+        return self.connection
+
+    async def __aexit__(self, *exc_info):
+        await self.pool.release(self.connection)
+
+
+class SQLitePool:
+    """A fixed number of connections to one SQLite database, with the asyncpg Pool methods the bot uses.
+
+    The database runs in WAL mode, so readers on any connection never wait for the writer."""
+    def __init__(self, path: str, connections: int = 4, init: Optional[Callable[[SQLiteConnection], Awaitable]] = None):
+        self.path = path
+        self.size = connections
+        self.init = init
+        self.connections: List[SQLiteConnection] = []
+        self.idle: asyncio.Queue = asyncio.Queue()
+
+    async def open(self):
+        for _ in range(self.size):
+            connection = SQLiteConnection(self.path)
+            await connection.connect()
+            if not self.connections:
+                await connection.execute(SCHEMA)
+            if self.init is not None:
+                await self.init(connection)
+            self.connections.append(connection)
+            self.idle.put_nowait(connection)
+
+    def acquire(self) -> PoolAcquireContext:
+        return PoolAcquireContext(self)
+
+    async def release(self, connection: SQLiteConnection):
+        self.idle.put_nowait(connection)
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+
+    async def fetch(self, query: str, *args):
+        async with self.acquire() as connection:
+            return await connection.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args):
+        async with self.acquire() as connection:
+            return await connection.fetchrow(query, *args)
+
+    async def fetchval(self, query: str, *args):
+        async with self.acquire() as connection:
+            return await connection.fetchval(query, *args)
+
+    async def execute(self, query: str, *args) -> str:
+        async with self.acquire() as connection:
+            return await connection.execute(query, *args)
+
+
+async def create_pool(path: str, connections: int = 4, init: Optional[Callable[[SQLiteConnection], Awaitable]] = None) -> SQLitePool:
+    """Opens a pool of connections to a SQLite database file, creating the database and its tables if needed."""
+    pool = SQLitePool(path, connections, init)
+    await pool.open()
+    return pool
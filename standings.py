@@ -0,0 +1,148 @@
+"""
+League standings for the Fake Soccer Bot
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+
+import queries
+from discord_db_client import Bot
+
+
+# Gamestates of games whose result counts. Abandoned games and scrimmages never count.
+COUNTED_STATES = ('FINAL', 'FORFEIT')
+WIN_POINTS = 3
+DRAW_POINTS = 1
+
+
+class TeamRecord:
+    """A team's line in the standings."""
+    __slots__ = ('teamid', 'played', 'won', 'drawn', 'lost', 'goals_for', 'goals_against')
+
+    def __init__(self, teamid: str):
+        self.teamid = teamid
+        self.played = self.won = self.drawn = self.lost = self.goals_for = self.goals_against = 0
+
+    def __repr__(self):
+        return f'<TeamRecord {self.teamid} {self.won}-{self.drawn}-{self.lost} {self.goals_for}:{self.goals_against}>'
+
+    @property
+    def points(self) -> int:
+        return WIN_POINTS * self.won + DRAW_POINTS * self.drawn
+
+    @property
+    def goal_difference(self) -> int:
+        return self.goals_for - self.goals_against
+
+    def add(self, scored: int, conceded: int, sign: int = 1):
+        """Adds the result of a game to the record, or takes it away again if sign is -1."""
+        self.played += sign
+        self.goals_for += sign * scored
+        self.goals_against += sign * conceded
+        if scored > conceded:
+            self.won += sign
+        elif scored < conceded:
+            self.lost += sign
+        else:
+            self.drawn += sign
+
+
+class Standings:
+    """Played, won, drawn, lost, goals and points of every team, from the finished games that are not scrimmages.
+
+    Results are added one game at a time as games finish, so the table never needs an aggregate over the games table.
+    The result of every counted game is kept, so recording a game again (after its score was corrected, or it was
+    abandoned after it ended) replaces its earlier result instead of counting it twice. The sorted table is only
+    rebuilt after a result has changed."""
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.results: Dict[int, Tuple[str, str, int, int]] = {}
+        self.teams: Dict[str, TeamRecord] = {}
+        self.version = 0
+        self._table: Optional[List[TeamRecord]] = None
+        self._recorded: Optional[Set[int]] = None
+
+    def __len__(self):
+        return len(self.teams)
+
+    def record(self, game):
+        """Counts the current result of a game, or stops counting it if it is not a finished game of the league."""
+        if self._recorded is not None:
+            self._recorded.add(game.gameid)
+        if game.gamestate in COUNTED_STATES and not game.isscrimmage:
+            self._set(game.gameid, (game.hometeam, game.awayteam, game.homescore, game.awayscore))
+        else:
+            self._set(game.gameid, None)
+
+    def _set(self, gameid: int, result: Optional[Tuple[str, str, int, int]]):
+        previous = self.results.get(gameid)
+        if previous == result:
+            return
+        if previous is not None:
+            del self.results[gameid]
+            self._add(previous, -1)
+        if result is not None:
+            self.results[gameid] = result
+            self._add(result, 1)
+        self._table = None
+        self.version += 1
+
+    def _add(self, result: Tuple[str, str, int, int], sign: int):
+        hometeam, awayteam, homescore, awayscore = result
+        for teamid, scored, conceded in ((hometeam, homescore, awayscore), (awayteam, awayscore, homescore)):
+            team = self.teams.get(teamid)
+            if team is None:
+                team = self.teams[teamid] = TeamRecord(teamid)
+            team.add(scored, conceded, sign)
+            if not team.played:
+                del self.teams[teamid]
+
+    def table(self) -> List[TeamRecord]:
+        """Returns every team that has played, ordered by points, then goal difference, then goals scored."""
+        if self._table is None:
+            self._table = sorted(self.teams.values(), key=lambda team: (-team.points, -team.goal_difference, -team.goals_for, team.teamid))
+        return self._table
+
+    def page(self, number: int, size: int = 20) -> List[Tuple[int, TeamRecord]]:
+        """Returns the (position, team) pairs on a page of the table. Pages start at 1."""
+        start = (number - 1) * size
+        return list(enumerate(self.table()[start:start + size], start=start + 1)) if number > 0 else []
+
+    async def rebuild(self):
+        """Replaces every result with the finished games in the database.
+
+        Games recorded while the query runs already have a newer result than the one it returns, so they are kept."""
+        self._recorded = set()
+        try:
+            records = await queries.fetch(self.bot.db, 'finished_games')
+        finally:
+            recorded, self._recorded = self._recorded, None
+        results = {record['gameid']: (record['hometeam'], record['awayteam'], record['homescore'], record['awayscore'])
+                   for record in records if record['gameid'] not in recorded}
+        results.update((gameid, self.results[gameid]) for gameid in recorded if gameid in self.results)
+        self.results, self.teams = {}, {}
+        for gameid, result in results.items():
+            self.results[gameid] = result
+            self._add(result, 1)
+        self._table = None
+        self.version += 1
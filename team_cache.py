@@ -0,0 +1,118 @@
+"""
+In-memory index of teams and the users managing them for the Fake Soccer Bot
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import bisect
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+import queries
+from discord_db_client import Bot
+
+
+class TeamCache:
+    """Maps team ids to their name and acting manager (the substitute if there is one), and users back to their teams.
+
+    Also keeps every team id in sorted order, so the team list can be paged and searched without the database."""
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.by_id: Dict[str, Tuple[str, int]] = {}
+        self.by_user: Dict[int, Set[str]] = {}
+        self.ids: List[str] = []
+
+    def __contains__(self, teamid: str):
+        return teamid in self.by_id
+
+    def teams_of(self, userid: int) -> Set[str]:
+        """Returns the ids of every team a user is currently managing."""
+        return self.by_user.get(userid, set())
+
+    def user_of(self, teamid: str) -> Optional[int]:
+        """Returns the user id of the acting manager of a team."""
+        team = self.by_id.get(teamid)
+        return None if team is None else team[1]
+
+    def set(self, teamid: str, teamname: str, manager: int, substitute: Optional[int] = None):
+        """Adds a team to the cache, or replaces it if it is already cached."""
+        self.remove(teamid)
+        userid = manager if substitute is None else substitute
+        self.by_id[teamid] = (teamname, userid)
+        self.by_user.setdefault(userid, set()).add(teamid)
+        bisect.insort(self.ids, teamid)
+
+    def remove(self, teamid: str):
+        team = self.by_id.pop(teamid, None)
+        if team is None:
+            return
+        del self.ids[bisect.bisect_left(self.ids, teamid)]
+        teams = self.by_user.get(team[1])
+        if teams is not None:
+            teams.discard(teamid)
+            if not teams:
+                del self.by_user[team[1]]
+
+    def page(self, number: int, size: int = 10) -> List[Tuple[str, str]]:
+        """Returns the (team id, team name) pairs on a page of the team list, in team id order. Pages start at 1."""
+        start = (number - 1) * size
+        return [(teamid, self.by_id[teamid][0]) for teamid in self.ids[start:start + size]] if number > 0 else []
+
+    def with_prefix(self, prefix: str) -> List[Tuple[str, str]]:
+        """Returns every team whose id starts with prefix, in team id order."""
+        start = bisect.bisect_left(self.ids, prefix)
+        end = bisect.bisect_left(self.ids, prefix + '\uffff')
+        return [(teamid, self.by_id[teamid][0]) for teamid in self.ids[start:end]]
+
+    def matching(self, pattern: re.Pattern) -> List[Tuple[str, str]]:
+        """Returns every team whose id or name matches a regular expression, in team id order."""
+        return [(teamid, self.by_id[teamid][0]) for teamid in self.ids
+                if pattern.search(teamid) or pattern.search(self.by_id[teamid][0])]
+
+    def search(self, text: str) -> List[Tuple[str, str]]:
+        """Returns every team whose id starts with text, then every other team whose id or name contains it, ignoring case."""
+        prefixed = self.with_prefix(text.lower())
+        found = {teamid for teamid, _ in prefixed}
+        pattern = re.compile(re.escape(text), re.IGNORECASE)
+        return prefixed + [team for team in self.matching(pattern) if team[0] not in found]
+
+    async def reload(self):
+        """Replaces the contents of the cache with every team in the database."""
+        by_id, by_user = {}, {}
+        teams = await queries.fetch(self.bot.db, 'all_teams')
+        for team in teams:
+            manager_or_sub = team['manager']
+            if team['substitute'] is not None:
+                manager_or_sub = team['substitute']
+            by_id[team['teamid']] = (team['teamname'], manager_or_sub)
+            by_user.setdefault(manager_or_sub, set()).add(team['teamid'])
+        self.by_id, self.by_user, self.ids = by_id, by_user, sorted(by_id)
+
+    async def on_change(self, teamid: str):
+        """Handles a change notification for a team."""
+        await self.load(teamid)
+
+    async def load(self, teamid: str):
+        """Reloads a single team from the database, dropping it from the cache if it no longer exists."""
+        team = await queries.fetchrow(self.bot.db, 'team', teamid)
+        if team is None:
+            return self.remove(teamid)
+        self.set(team['teamid'], team['teamname'], team['manager'], team['substitute'])
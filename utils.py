@@ -51,17 +51,13 @@ def calculate_diff(num1: int, num2: int) -> int:
     return diff
 
 
+# (highest d1000 roll, minutes of stoppage time), in ascending order of roll
+EXTRA_TIME_CURVE = ((23, 1), (46, 6), (182, 2), (318, 5), (659, 3), (1000, 4))
+
+
 def extra_time_bell_curve():
     """Random extra time based on bell curve distribution"""
     d1000 = randint(1, 1000)
-    if d1000 <= 23:
-        return 1
-    if d1000 <= 46:
-        return 6
-    if d1000 <= 182:
-        return 2
-    if d1000 <= 318:
-        return 5
-    if d1000 <= 659:
-        return 3
-    return 4
+    for highest_roll, minutes in EXTRA_TIME_CURVE:
+        if d1000 <= highest_roll:
+            return minutes
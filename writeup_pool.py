@@ -0,0 +1,107 @@
+"""
+In-memory pool of the Fake Soccer Bot's enabled writeups, for picking one at random on every play
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import random
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+import queries
+from discord_db_client import Bot
+
+
+TEMPLATE_FIELDS = frozenset(('offteam', 'defteam'))
+
+logger = logging.getLogger('fakeSoccerBot')
+
+
+class WriteupTemplateError(ValueError):
+    """Raised when the text of a writeup can not be filled in with the teams of a play."""
+
+
+def validate(writeup_text: str):
+    """Checks that a writeup only uses the {offteam} and {defteam} fields, and raises WriteupTemplateError if not."""
+    try:
+        fields = [field for _, field, _, _ in Formatter().parse(writeup_text) if field is not None]
+    except ValueError as error:
+        raise WriteupTemplateError(f'{error}. Use {{{{ and }}}} for literal braces.') from None
+    for field in fields:
+        if field not in TEMPLATE_FIELDS:
+            raise WriteupTemplateError(f'{{{field}}} is not a valid field. Only {{offteam}} and {{defteam}} can be used.')
+
+
+class WriteupPool:
+    """Every enabled writeup, grouped by (gamestate, result) so one can be picked at random in constant time.
+
+    The Writeups cog passes every writeup it inserts or changes to set(), which moves or drops it in the pool.
+    Writeups are removed by swapping them with the last one in their group, so no change needs a scan either."""
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.by_key: Dict[Tuple[str, str], List[str]] = {}
+        self._ids: Dict[Tuple[str, str], List[int]] = {}
+        self._positions: Dict[int, Tuple[Tuple[str, str], int]] = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def choose(self, gamestate: str, result: str) -> Optional[str]:
+        """Returns the text of a random enabled writeup for a play, or None if there are none."""
+        texts = self.by_key.get((gamestate, result))
+        return random.choice(texts) if texts else None
+
+    def set(self, record):
+        """Adds, replaces or drops a writeup, depending on whether it is enabled and valid."""
+        self.remove(record['writeupid'])
+        if record['disabled']:
+            return
+        try:
+            validate(record['writeuptext'])
+        except WriteupTemplateError as error:
+            logger.warning(f"Leaving writeup {record['writeupid']} out of the pool: {error}")
+            return
+        key = (record['gamestate'], record['result'])
+        texts, ids = self.by_key.setdefault(key, []), self._ids.setdefault(key, [])
+        self._positions[record['writeupid']] = (key, len(texts))
+        texts.append(record['writeuptext'])
+        ids.append(record['writeupid'])
+
+    def remove(self, writeupid: int):
+        position = self._positions.pop(writeupid, None)
+        if position is None:
+            return
+        key, index = position
+        texts, ids = self.by_key[key], self._ids[key]
+        last_text, last_id = texts.pop(), ids.pop()
+        if last_id != writeupid:
+            texts[index], ids[index] = last_text, last_id
+            self._positions[last_id] = (key, index)
+        if not texts:
+            del self.by_key[key], self._ids[key]
+
+    async def reload(self):
+        """Replaces the contents of the pool with every enabled writeup in the database."""
+        self.by_key, self._ids, self._positions = {}, {}, {}
+        for record in await queries.fetch(self.bot.db, 'enabled_writeups'):
+            self.set(record)
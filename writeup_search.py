@@ -0,0 +1,173 @@
+"""
+In-process full text search index over the Fake Soccer Bot's writeups
+
+
+Copyright (c) 2021 NotAName
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import bisect
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import queries
+from discord_db_client import Bot
+from writeup_pool import TEMPLATE_FIELDS
+
+
+TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Terms that are only a prefix of a word in a writeup count for this much of a full match
+PREFIX_WEIGHT = 0.5
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into lowercase words, leaving out the {offteam} and {defteam} template fields."""
+    return [token for token in TOKEN.findall(text.lower()) if token not in TEMPLATE_FIELDS]
+
+
+class Document(NamedTuple):
+    gamestate: str
+    result: str
+    disabled: bool
+    text: str
+    length: int
+
+
+class Match(NamedTuple):
+    writeupid: int
+    score: float
+    gamestate: str
+    result: str
+    disabled: bool
+    text: str
+
+
+class WriteupIndex:
+    """Inverted index from words to the writeups containing them, ranked with BM25.
+
+    Every search term also matches the words it is a prefix of, found by bisecting the sorted vocabulary, but those
+    matches rank lower than whole words. All terms have to match. Results are ordered by score and then writeup id,
+    and a page of results continues after the score and writeup id of the last result on the previous page, so later
+    pages cost the same as the first one and still continue in the right place if that writeup has changed since. The
+    Writeups cog passes every writeup it adds, edits or toggles to set(), which keeps the index in sync."""
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.documents: Dict[int, Document] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.vocabulary: List[str] = []
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def set(self, record):
+        """Adds a writeup to the index, or re-indexes it if it is already there."""
+        self.remove(record['writeupid'])
+        tokens = tokenize(record['writeuptext'])
+        self.documents[record['writeupid']] = Document(record['gamestate'], record['result'], record['disabled'],
+                                                       record['writeuptext'], len(tokens))
+        self._total_length += len(tokens)
+        for token, count in Counter(tokens).items():
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = {}
+                bisect.insort(self.vocabulary, token)
+            postings[record['writeupid']] = count
+
+    def remove(self, writeupid: int):
+        document = self.documents.pop(writeupid, None)
+        if document is None:
+            return
+        self._total_length -= document.length
+        for token in set(tokenize(document.text)):
+            postings = self.postings[token]
+            del postings[writeupid]
+            if not postings:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def _expand(self, term: str) -> List[Tuple[str, float]]:
+        """Returns the words a term matches and how much each one counts."""
+        words = []
+        index = bisect.bisect_left(self.vocabulary, term)
+        while index < len(self.vocabulary) and self.vocabulary[index].startswith(term):
+            word = self.vocabulary[index]
+            words.append((word, 1.0 if word == term else PREFIX_WEIGHT))
+            index += 1
+        return words
+
+    def search(self, query: str, gamestate: Optional[str] = None, result: Optional[str] = None,
+               after: Optional[Tuple[float, int]] = None, limit: int = 10) -> Tuple[List[Match], bool]:
+        """Returns a page of the writeups matching every word of a query, best first, and whether there are more.
+
+        after is the (score, writeup id) of the last result on the previous page."""
+        terms = tokenize(query)
+        if not terms or not self.documents:
+            return [], False
+        expansions = [self._expand(term) for term in dict.fromkeys(terms)]
+        candidates: Optional[Set[int]] = None
+        for words in sorted(expansions, key=lambda words: sum(len(self.postings[word]) for word, _ in words)):
+            matching = set()
+            for word, _ in words:
+                matching.update(self.postings[word])
+            candidates = matching if candidates is None else candidates & matching
+            if not candidates:
+                return [], False
+
+        total = len(self.documents)
+        average_length = self._total_length / total or 1
+        scores: Dict[int, float] = {}
+        for writeupid in candidates:
+            document = self.documents[writeupid]
+            if (gamestate is not None and document.gamestate != gamestate) or (result is not None and document.result != result):
+                continue
+            score = 0.0
+            norm = K1 * (1 - B + B * document.length / average_length)
+            for words in expansions:
+                best = 0.0
+                for word, weight in words:
+                    postings = self.postings[word]
+                    frequency = postings.get(writeupid)
+                    if frequency:
+                        idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                        best = max(best, weight * idf * frequency * (K1 + 1) / (frequency + norm))
+                score += best
+            scores[writeupid] = score
+
+        ranked = ((-score, writeupid) for writeupid, score in scores.items())
+        if after is not None:
+            cursor = (-after[0], after[1])
+            ranked = (key for key in ranked if key > cursor)
+        page = heapq.nsmallest(limit + 1, ranked)
+        matches = [Match(writeupid, -negative_score, *self.documents[writeupid][:4])
+                   for negative_score, writeupid in page[:limit]]
+        return matches, len(page) > limit
+
+    async def reload(self):
+        """Replaces the contents of the index with every writeup in the database."""
+        self.documents, self.postings, self.vocabulary, self._total_length = {}, {}, [], 0
+        for record in await queries.fetch(self.bot.db, 'all_writeups'):
+            self.set(record)